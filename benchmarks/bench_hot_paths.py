@@ -0,0 +1,282 @@
+"""Micro-benchmarks of the pure Python hot paths, on synthetic data at a realistic scale.
+
+Nothing is sent over the network: the cache is an in memory SQLite database
+filled with a synthetic game list, game details and player ids.
+
+    poetry run python benchmarks/bench_hot_paths.py --output bench.json
+    poetry run python benchmarks/bench_hot_paths.py --compare bench.json
+
+Results are saved as json (seconds per call) so runs of two commits can be
+compared with --compare.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bga_match_maker import bga_options, main as bga_main, utils  # noqa: E402
+from bga_match_maker.bga_account import BGAAccount  # noqa: E402
+from bga_match_maker.bga_game_list import get_game_catalog, get_game_list, is_game_valid  # noqa: E402
+from bga_match_maker.cache_to_file import SQLiteBackend, invalidate, set_backend  # noqa: E402
+from bga_match_maker.table_index import TableIndex  # noqa: E402
+
+GAMES = 5000
+PLAYERS = 500
+CREATOR = "creator"
+CREATOR_ID = "1"
+GAME_OPTIONS = [
+    {"id": 100 + i, "name": f"Option {i}", "values": [{"id": v, "name": f"Value {v}"} for v in range(5)]}
+    for i in range(40)
+]
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def game_name(i):
+    return f"Game {i:05d} of the bench"
+
+
+def player_name(i):
+    return f"player {i}"
+
+
+def fill_cache():
+    """A fresh in memory cache with a game list, game details and player ids."""
+    backend = SQLiteBackend(":memory:")
+    set_backend(backend)
+    bga_options.clear_plans()
+    expires_at = time.time() + 3600
+    games = {
+        game_name(i): {"id": i, "codename": f"game{i}", "display_name_en": game_name(i), "player_numbers": [2, 3, 4]}
+        for i in range(1, GAMES + 1)
+    }
+    backend.set("game_list", "bga_game_list", games, expires_at)
+    for i in range(1, 101):
+        backend.set("game_info", f"game{i}", {"name": f"game{i}", "options": GAME_OPTIONS}, expires_at)
+    backend.set_many("player_id", {player_name(i): str(1000 + i) for i in range(PLAYERS)}, expires_at)
+    backend.set_many("player_id", {CREATOR: CREATOR_ID}, expires_at)
+    return backend
+
+
+def make_account():
+    return BGAAccount({"cookies": [], "request_token": "0", "username": CREATOR})
+
+
+def operations_tree(depth, width):
+    """Nested operations of depth levels with width children each, a limit every other level."""
+    counter = iter(range(10 ** 9))
+
+    def node(level):
+        i = next(counter)
+        elem = {"options": {"speed": "1/2days"}, "toInvite": player_name(i % PLAYERS)}
+        if level % 2 == 0:
+            elem["limit"] = width
+        if level == depth:
+            elem["game"] = game_name(1 + i % 100)
+        else:
+            elem["children"] = [node(level + 1) for _ in range(width)]
+        return elem
+
+    return {"toCreate": CREATOR, "children": [node(1) for _ in range(width)]}
+
+
+def synthetic_tables(count):
+    tables = {}
+    for i in range(count):
+        table_id = str(100000 + i)
+        invited = player_name(i % PLAYERS)
+        tables[table_id] = {
+            "id": table_id,
+            "game_id": str(1 + i % 100),
+            "table_creator": CREATOR_ID,
+            "max_player": "2",
+            "players": {CREATOR_ID: {"fullname": CREATOR}, str(1000 + i): {"fullname": invited}},
+            "options": {"200": "19", "201": "0"},
+        }
+    return tables
+
+
+@benchmark("config_operations_deep_tree")
+def bench_config_operations(tmp_dir):
+    # 6 levels of 4 children: 4096 games and 5460 nodes
+    path = os.path.join(tmp_dir, "operations.json")
+    with open(path, "w") as f:
+        json.dump(operations_tree(6, 4), f)
+    config = bga_main.Config("", path, False, False)
+    return lambda: config.operations()
+
+
+@benchmark("parse_options_warm")
+def bench_parse_options(tmp_dir):
+    account = make_account()
+    options = {"speed": "1/2days", "minrep": "75", "levels": "good-master", "Option 3": "Value 2", "Option 39": "Value 4"}
+    account.parse_options(options, None, "game1")
+    return lambda: account.parse_options(options, None, "game1")
+
+
+@benchmark("table_matching_reconcile")
+def bench_reconcile(tmp_dir):
+    tables = synthetic_tables(2000)
+
+    class BenchAccount(BGAAccount):
+        def get_tables(self, player_id):
+            return tables
+
+    account = BenchAccount({"cookies": [], "request_token": "0", "username": CREATOR})
+    operations = [
+        bga_main.Operation(game_name(1 + i % 100), CREATOR, [], [player_name(i % PLAYERS)], {"speed": "1/2days"})
+        for i in range(3000)
+    ]
+    user = bga_main.User(CREATOR)
+    return lambda: bga_main.reconcile(account, CREATOR_ID, user, operations, True)
+
+
+@benchmark("table_index_find")
+def bench_table_index(tmp_dir):
+    tables = synthetic_tables(2000)
+    names = [frozenset((CREATOR, player_name(i))) for i in range(PLAYERS)]
+    options = frozenset({("200", "19")})
+
+    def run():
+        index = TableIndex(tables, CREATOR_ID)
+        for i in range(2000):
+            index.find(1 + i % 100, names[i % PLAYERS], None, options)
+
+    return run
+
+
+@benchmark("create_table_name_resolution")
+def bench_resolve(tmp_dir):
+    get_game_catalog()
+    parts = [game_name(i).lower() for i in range(1, GAMES + 1, 5)] + ["game 0001", "game 04999 of", "nothing"]
+
+    def run():
+        catalog = get_game_catalog()
+        for part in parts:
+            catalog.resolve(part)
+
+    return run
+
+
+@benchmark("is_game_valid")
+def bench_is_game_valid(tmp_dir):
+    names = [game_name(i) for i in range(1, GAMES + 1, 5)] + [f"game{i}" for i in range(1, 200)] + ["123", "unknown"]
+
+    def run():
+        for name in names:
+            is_game_valid(name)
+
+    return run
+
+
+@benchmark("get_game_list_cache_load")
+def bench_game_list_load(tmp_dir):
+    def run():
+        # Drop the in memory tier so the list is read from the backend
+        invalidate("bga_game_list", namespace="game_list")
+        get_game_list()
+
+    return run
+
+
+@benchmark("send_message_partials_large")
+def bench_send_message_partials(tmp_dir):
+    lines = [f"\tLine {i}: " + "word " * (i % 40) for i in range(5000)]
+    text = "\n".join(lines)
+
+    class Sink:
+        async def send(self, message):
+            pass
+
+    return lambda: asyncio.run(utils.send_message_partials(Sink(), text))
+
+
+def measure(func, min_time, repeat):
+    """Seconds per call of func: (number of calls per run, one timing per run)."""
+    func()
+    start = time.perf_counter()
+    func()
+    one = max(time.perf_counter() - start, 1e-9)
+    number = max(1, int(min_time / one))
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return number, timings
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench-hot-paths")
+    parser.add_argument("--output", default=None, help="Write the results to this json file")
+    parser.add_argument("--compare", default=None, help="Json results of a previous run to compare with")
+    parser.add_argument("--filter", default=None, help="Only run benchmarks whose name contains this")
+    parser.add_argument("--min-time", default=0.2, type=float, help="Minimum seconds of one timing run")
+    parser.add_argument("--repeat", default=5, type=int)
+    args = parser.parse_args()
+
+    # Logs would be most of what is measured
+    logging.disable(logging.INFO)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)["results"]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, setup in BENCHMARKS.items():
+            if args.filter and args.filter not in name:
+                continue
+            fill_cache()
+            number, timings = measure(setup(tmp_dir), args.min_time, args.repeat)
+            results[name] = {
+                "number": number,
+                "min": min(timings),
+                "median": statistics.median(timings),
+                "mean": statistics.mean(timings),
+            }
+            line = f"{name:<32} {results[name]['min'] * 1000:10.3f} ms (median {results[name]['median'] * 1000:.3f} ms)"
+            if name in previous:
+                line += f"  x{results[name]['min'] / previous[name]['min']:.2f} vs {args.compare}"
+            print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "timestamp": time.time(),
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Check that the command line tool starts fast.
+
+Imports the entry points in a fresh interpreter with `python -X importtime`
+and fails (exit code 1) when one of them takes longer than its budget or pulls
+in a module that only runs need (requests, asyncio).
+
+    poetry run python benchmarks/check_import_time.py
+    poetry run python benchmarks/check_import_time.py --budget 50 --runs 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Entry points that must start fast: the command line (--help, --validate) and validation
+MODULES = ("bga_match_maker.main", "bga_match_maker.validate")
+# Only imported once the tool talks to BGA
+FORBIDDEN = ("requests", "urllib3", "asyncio")
+# Milliseconds, for the cumulative import time of each module
+DEFAULT_BUDGET = 75
+
+
+def import_times(module):
+    """{module name: cumulative import time in microseconds} when importing module in a fresh interpreter."""
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="check-import-time")
+    parser.add_argument("--budget", default=DEFAULT_BUDGET, type=float, help="Milliseconds allowed per module")
+    parser.add_argument("--runs", default=5, type=int, help="The best of this many runs is kept")
+    args = parser.parse_args()
+
+    ok = True
+    for module in MODULES:
+        runs = [import_times(module) for _ in range(args.runs)]
+        best = min(times[module] for times in runs) / 1000
+        status = "ok" if best <= args.budget else "over budget"
+        print(f"{module:<30} {best:7.1f} ms (budget {args.budget:g} ms) {status}")
+        ok = ok and best <= args.budget
+        forbidden = sorted(name for name in runs[0] if name.split(".")[0] in FORBIDDEN)
+        if forbidden:
+            print(f"  imports {', '.join(forbidden)}")
+            ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
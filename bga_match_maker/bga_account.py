@@ -1,60 +1,46 @@
 """Create a connection to Board Game Arena and interact with it."""
 import json
 import logging
-from logging.handlers import RotatingFileHandler
 import re
 import time
 import urllib.parse
-import requests
 
-from bga_match_maker.cache_to_file import cache_to_file
+from bga_match_maker.cache_to_file import cache_to_file, get_backend, memory
 
-from .bga_game_list import get_game_list
+from .bga_game_list import get_game_catalog
+from .bga_options import CHANGE_OPTION_PATH, GAME_INFO_NAMESPACE, OptionError, compile_options
+from .groups import GROUPS_DURATION, GROUPS_NAMESPACE, GROUPS_REFRESH_AFTER, GroupIndex
+from . import http_cache, metrics, transport
+from .rate_limiter import shared_limiter
+from .session_store import cookies_from_list, cookies_to_list
 
 logger = logging.getLogger(__name__)
 
-MODE_TYPES = {
-    "normal": 0,
-    "training": 1,
-}
-MODE_VALUES = list(MODE_TYPES.keys())
-SPEED_TYPES = {
-    "fast": 0,
-    "normal": 1,
-    "slow": 2,
-    "24/day": 10,
-    "12/day": 11,
-    "8/day": 12,
-    "4/day": 13,
-    "3/day": 14,
-    "2/day": 15,
-    "1/day": 17,
-    "1/2days": 19,
-    "nolimit": 20,
-}
-SPEED_VALUES = list(SPEED_TYPES.keys())
-KARMA_TYPES = {"0": 0, "50": 1, "65": 2, "75": 3, "85": 4}
-KARMA_VALUES = list(KARMA_TYPES.keys())
-LEVEL_VALUES = [
-    "beginner",
-    "apprentice",
-    "average",
-    "good",
-    "strong",
-    "expert",
-    "master",
-]
+# Player ids never change. Names that were not found may be registered later.
+PLAYER_ID_NAMESPACE = "player_id"
+PLAYER_ID_DURATION = 90 * 24 * 3600
+PLAYER_NOT_FOUND_DURATION = 24 * 3600
 
 
 class BGAAccount:
     """Account user/pass and methods to login/create games with it."""
 
-    def __init__(self):
-        self.base_url = "https://boardgamearena.com"
-        self.session = requests.Session()
+    def __init__(self, session_state=None):
+        """Start a new session, or resume one saved with session_state()."""
+        self.base_url = transport.base_url()
+        self.session = transport.make_session()
+        self.rate_limiter = shared_limiter
+        self.username = None
+        self._group_index = None
+        # When _group_index was read from BGA, None if it came from the cache
+        self._groups_read_at = None
+        if session_state is not None:
+            cookies_from_list(self.session.cookies, session_state["cookies"])
+            self.request_token = session_state["request_token"]
+            self.username = session_state.get("username")
+            return
         # Get CSRF token from login pagetext
-        resp = self.session.get(self.base_url + "/account")
-        resp_text = resp.text
+        resp_text = self.send("GET", self.base_url + "/account").text
         # example: <input type='hidden' name='request_token' id='request_token' value='soJoMkn9CHYUDg6' />
         request_token_match = re.search(r"requestToken: '([0-9a-f]*)',", resp_text)
         if not request_token_match:
@@ -62,25 +48,62 @@ class BGAAccount:
             raise Exception("Could not get request token")
         self.request_token = request_token_match[1]
 
-    def fetch(self, url, **kwargs):
-        """Generic get."""
+    def session_state(self):
+        """What is needed to resume this session later without login in again."""
+        return {
+            "cookies": cookies_to_list(self.session.cookies),
+            "request_token": self.request_token,
+            "username": self.username,
+        }
+
+    def send(self, method, url, **kwargs):
+        """Send a request once the rate limiter allows it and report back how it went."""
+        return transport.send(self.session, method, url, self.rate_limiter, **kwargs)
+
+    def fetch(self, url, cache=None, **kwargs):
+        """Generic get. Responses of the endpoints in http_cache.POLICIES are cached and
+        revalidated, cache=True caches any lookup and cache=False never uses the cache."""
         logger.debug("\nGET: " + url)
-        time.sleep(1)
 
         # This cookie need to also be in the headers.
         request_token = self.session.cookies.get("TournoiEnLigneidt")
         if request_token:
             kwargs.setdefault("headers", {}).setdefault("X-Request-Token", request_token)
-        with self.session.get(url, **kwargs) as response:
+
+        # Responses are stored by account: without a username (sessions saved by older
+        # versions), they could be served to another account.
+        policy = http_cache.policy_for(url, cache) if self.username else None
+        stored = None
+        if policy is not None:
+            key = http_cache.cache_key(self.username, url)
+            stored = http_cache.load(key)
+            if stored is not None and http_cache.is_fresh(stored, policy):
+                metrics.registry.inc("bga_cache_requests_total", namespace=http_cache.HTTP_NAMESPACE, result="hit")
+                return stored["body"]
+            if stored is not None and stored["body"] is not None:
+                kwargs.setdefault("headers", {}).update(http_cache.conditional_headers(stored))
+            else:
+                stored = None
+
+        with self.send("GET", url, **kwargs) as response:
+            if stored is not None and response.status_code == 304:
+                logger.debug(f"Not modified {url}")
+                metrics.registry.inc("bga_cache_requests_total", namespace=http_cache.HTTP_NAMESPACE, result="revalidated")
+                http_cache.refresh(key, stored, policy)
+                return stored["body"]
             resp_text = response.text
+            if policy is not None:
+                metrics.registry.inc("bga_cache_requests_total", namespace=http_cache.HTTP_NAMESPACE, result="miss")
+                if response.status_code == 200:
+                    http_cache.save(key, response, resp_text, policy)
             if resp_text[0] in ["{", "["]:  # If it's a json
                 logger.debug(f"Fetched {url}. Resp: " + resp_text[:150])
             return resp_text
 
     def post(self, url, params, **kwargs):
-        time.sleep(1)
-        """Generic post."""
-        with self.session.post(url, data=params, **kwargs) as response:
+        """Generic post. Never cached: posts change something on BGA, or are cached
+        by their caller (like gameDetails with cache_to_file)."""
+        with self.send("POST", url, data=params, **kwargs) as response:
             resp_text = response.text
             logger.debug(f"Posted {url}. Resp: " + resp_text[:80])
             return response
@@ -100,6 +123,9 @@ class BGAAccount:
         }
         logger.debug("LOGIN: " + url + "\nEMAIL: " + params["email"] + "\ncsrf_token:" + self.request_token)
         self.post(url, params)
+        self.username = username
+        self._group_index = None
+        self._groups_read_at = None
         return self.verify_privileged()
 
     def logout(self):
@@ -140,37 +166,16 @@ class BGAAccount:
         Partial game names are ok, like race for raceforthegalaxy.
         Returns (table id (int), error string (str))"""
         # Try to close any logged-in session gracefully
-        lower_game_name = re.sub(r"[^a-z0-9]", "", game_name_part.lower())
         # self.quit_table()
         self.quit_playing_with_friends()
         try:
-            games = get_game_list()
+            catalog = get_game_catalog()
         except Exception:
             return None, -1, "Could not get game list"
-        lower_games = {}
-        for game in games:
-            lower_name = re.sub(r"[^a-z0-9]", "", game.lower())
-            lower_games[lower_name] = games[game]
         # If name is unique like "race" for "raceforthegalaxy", use that
-        games_found = []
-        game_name = ""
-        for game_i in list(lower_games.keys()):
-            if game_i == lower_game_name:  # if there's an exact match, take it!
-                game_name = lower_game_name
-            elif game_i.startswith(lower_game_name):
-                games_found.append(game_i)
-        if len(game_name) == 0:
-            if len(games_found) == 0:
-                err = (
-                    f"`{lower_game_name}` is not available on BGA. Check your spelling "
-                    f"(capitalization and special characters do not matter)."
-                )
-                return None, -1, err
-            elif len(games_found) > 1:
-                err = f"`{lower_game_name}` matches [{','.join(games_found)}]. Use more letters to match."
-                return None, -1, err
-            game_name = games_found[0]
-        game = lower_games[game_name]
+        game, err = catalog.resolve(game_name_part)
+        if game is None:
+            return None, -1, err
         game_id = game["id"]
         url = self.base_url + "/table/table/createnew.html"
         params = {
@@ -195,14 +200,43 @@ class BGAAccount:
         table_id = resp_json["data"]["table"]
         return game, table_id, ""
 
-    def set_table_options(self, options, table_id, game_name):
+    def set_table_options(self, options, table_id, game_name, current_options=None):
+        """Set options on a table, skipping the ones that already have the right value.
+        current_options is {option id: value} of the table, fetched when not given."""
         url_data = self.parse_options(options, table_id, game_name)
         if isinstance(url_data, str):  # In this case it's an error
             return url_data
         logger.debug("Got url data :" + str(url_data))
+        if current_options is None:
+            current_options = self.get_table_options(table_id)
+        # Sent one after the other: BGA options can depend on the value of others
         for url_datum in url_data:
+            if url_datum["path"] == CHANGE_OPTION_PATH:
+                params = url_datum["params"]
+                if str(current_options.get(str(params["id"]))) == str(params["value"]):
+                    logger.debug(f"Option {params['id']} already set to {params['value']}")
+                    continue
             self.set_option(table_id, url_datum["path"], url_datum["params"])
 
+    def get_table_options(self, table_id):
+        """{option id: value} of the changeoption.html options of a table. Empty if unknown."""
+        url = self.base_url + "/table/table/tableinfos.html"
+        params = {"id": table_id, "dojo.preventCache": str(int(time.time()))}
+        url += "?" + urllib.parse.urlencode(params)
+        try:
+            options = json.loads(self.fetch(url))["data"]["options"]
+        except Exception:
+            logger.debug(f"Could not read the options of table {table_id}")
+            return {}
+        if not isinstance(options, dict):
+            return {}
+        # Either {id: value} or {id: {"value": value, ...}}
+        return {
+            str(option_id): option["value"] if isinstance(option, dict) else option
+            for option_id, option in options.items()
+            if not isinstance(option, dict) or "value" in option
+        }
+
     def set_option(self, table_id, path, params):
         """Change the game options for the specified."""
         url = self.base_url + path
@@ -212,101 +246,28 @@ class BGAAccount:
 
     def parse_options(self, options, table_id, game_name):
         """Create url data that can be parsed as urls"""
-        # Set defaults if they're not present
-        defaults = {
-            "mode": "normal",
-            "presentation": "Made by the good bot"
-        }
-        # options will overwrite defaults if they are there
-        defaults.update(options)
-        updated_options = defaults
+        try:
+            plan = compile_options(game_name, options, self.get_game_info)
+        except OptionError as e:
+            return str(e)
         url_data = []
-        for option in updated_options:
-            value = updated_options[option]
-            option_data = {}
-            logger.debug(f"Reading option `{option}` with key `{value}`")
-            if option == "mode":
-                option_data["path"] = "/table/table/changeoption.html"
-                mode_name = updated_options[option]
-                if mode_name not in list(MODE_TYPES.keys()):
-                    return f"Valid modes are training and normal. You entered {mode_name}."
-                mode_id = MODE_TYPES[mode_name]
-                option_data["params"] = {"id": 201, "value": mode_id}
-            elif option == "speed":
-                option_data["path"] = "/table/table/changeoption.html"
-                speed_name = updated_options[option]
-                if speed_name not in list(SPEED_TYPES.keys()):
-                    return f"{speed_name} is not a valid speed. Check !bga options."
-                speed_id = SPEED_TYPES[speed_name]
-                option_data["params"] = {"id": 200, "value": speed_id}
-            elif option == "minrep":
-                option_data["path"] = "/table/table/changeTableAccessReputation.html"
-                if value not in list(KARMA_TYPES.keys()):
-                    return f"Invalid minimum karma {value}. Valid values are 0, 50, 65, 75, 85."
-                option_data["params"] = {"karma": KARMA_TYPES[value]}
-            elif option == "presentation":
-                # No error checking is necessary as every string is valid.
-                option_data["path"] = "/table/table/setpresentation.html"
-                option_data["params"] = {"value": updated_options[option]}
-            elif option == "levels":
-                if "-" not in value:
-                    return "levels requires a dash between levels like `good-strong`."
-                [min_level, max_level] = value.lower().split("-")
-                if min_level not in LEVEL_VALUES:
-                    return f"Min level {min_level} is not a valid level ({','.join(LEVEL_VALUES)})"
-                if max_level not in LEVEL_VALUES:
-                    return f"Max level {max_level} is not a valid level ({','.join(LEVEL_VALUES)})"
-                level_enum = {LEVEL_VALUES[i]: i for i in range(len(LEVEL_VALUES))}
-                min_level_num = level_enum[min_level]
-                max_level_num = level_enum[max_level]
-                level_keys = {}
-                for i in range(7):
-                    if min_level_num <= i <= max_level_num:
-                        level_keys["level" + str(i)] = "true"
-                    else:
-                        level_keys["level" + str(i)] = "false"
-                option_data["path"] = "/table/table/changeTableAccessLevel.html"
-                option_data["params"] = level_keys
-            elif option == "players":
-                # Change minimum and maximum number of players
-                option_data["path"] = "/table/table/changeWantedPlayers.html"
-                player = updated_options[option]
-                option_data["params"] = {"minp": player, "maxp": player}
-            elif option == "restrictgroup":
-                option_data["path"] = "/table/table/restrictToGroup.html"
-                group_options = self.get_group_options(table_id)
-                group_id = -1
-                for group_o in group_options:
-                    if group_o[1].startswith(value):
-                        group_id = group_o[0]
-                if group_id != -1:
-                    option_data["params"] = {"group": group_id}
-                else:
-                    groups_str = "[`" + "`,`".join([g[1] for g in group_options if g[1] != "-"]) + "`]"
+        for step in plan:
+            if step.option == "restrictgroup":
+                value = options[step.option]
+                groups = self.get_group_index(table_id)
+                group_id = groups.find(value)
+                if group_id == -1:
+                    # The account may have joined the group since its groups were cached
+                    groups = self.get_group_index(table_id, refresh=True)
+                    group_id = groups.find(value)
+                if group_id == -1:
+                    groups_str = "[`" + "`,`".join(groups.names()) + "`]"
                     return f"Unable to find group {value}. You are a member of groups {groups_str}."
-            elif option == "lang":
-                option_data["path"] = "/table/table/restrictToLanguage.html"
-                option_data["params"] = {"lang": updated_options[option]}
-            elif option.isdigit():
-                # If this is an HTML option, set it as such
-                option_data["path"] = "/table/table/changeoption.html"
-                option_data["params"] = {"id": option, "value": updated_options[option]}
+                params = {"group": group_id}
             else:
-                game_info = self.get_game_info(game_name)
-                try:
-                    game_option = next(go for go in game_info["options"] if go["name"] == option)
-                    option_id = game_option["id"]
-                    game_value = next(v for v in game_option["values"] if v["name"] == value)
-                    value_id = game_value["id"]
-
-                    option_data["path"] = "/table/table/changeoption.html"
-                    option_data["params"] = {"id": option_id, "value": value_id}
-
-                except StopIteration:
-                    logger.warn(f"Cannot set {option=} with {value=}")
-                    return f"Option {option} not a valid option."
-
-            url_data.append(option_data)
+                # Plans are shared, never hand out their params
+                params = dict(step.params)
+            url_data.append({"path": step.path, "params": params})
         return url_data
 
     def get_group_id(self, group_name):
@@ -329,6 +290,24 @@ class BGAAccount:
         community_text = self.fetch(self.base_url + "/community")
         return "You must be logged in to see this page." not in community_text
 
+    def get_group_index(self, table_id, refresh=False):
+        """GroupIndex of this account. The groups do not depend on the table, so they
+        are only read from a table page when they are not cached for the account, or
+        with refresh, unless they were just read from BGA."""
+        if refresh and self._groups_read_at is not None and time.time() - self._groups_read_at < GROUPS_REFRESH_AFTER:
+            refresh = False
+        if self._group_index is None or refresh:
+            entry = get_backend().get(GROUPS_NAMESPACE, self.username) if self.username and not refresh else None
+            if entry is not None and entry.is_fresh:
+                group_options = entry.value
+            else:
+                group_options = self.get_group_options(table_id)
+                self._groups_read_at = time.time()
+                if self.username:
+                    get_backend().set(GROUPS_NAMESPACE, self.username, group_options, time.time() + GROUPS_DURATION)
+            self._group_index = GroupIndex(group_options)
+        return self._group_index
+
     def get_group_options(self, table_id):
         """The friend group id is unique to every user. Search the table HTML for it."""
         table_url = self.base_url + "/table?nr=true&table=" + str(table_id)
@@ -339,6 +318,47 @@ class BGAAccount:
 
     def get_player_id(self, player):
         """Given the name of a player, get their player id."""
+        return self.get_player_ids([player])[player]
+
+    def get_player_ids(self, players):
+        """Resolve several player names, cached ids first. Returns {name: id}, id is -1 if not found."""
+        names = list(dict.fromkeys(players))
+        ids = self.cached_player_ids(names)
+        resolved = {name: self._get_player_id_no_cache(name) for name in names if name not in ids}
+        self.store_player_ids(resolved)
+        ids.update(resolved)
+        return {name: ids[name] for name in names}
+
+    def cached_player_ids(self, players):
+        """{name: id} of the players whose id is in the cache."""
+        ids = {}
+        for name in players:
+            player_id = memory.get((PLAYER_ID_NAMESPACE, name), None)
+            if player_id is not None:
+                ids[name] = player_id
+        in_memory = len(ids)
+        entries = get_backend().get_many(PLAYER_ID_NAMESPACE, [name for name in players if name not in ids])
+        for name, entry in entries.items():
+            if entry.is_fresh:
+                ids[name] = entry.value
+                memory.set((PLAYER_ID_NAMESPACE, name), entry.value, entry.expires_at)
+        for result, count in [("memory", in_memory), ("hit", len(ids) - in_memory), ("miss", len(players) - len(ids))]:
+            if count:
+                metrics.registry.inc("bga_cache_requests_total", count, namespace=PLAYER_ID_NAMESPACE, result=result)
+        return ids
+
+    def store_player_ids(self, ids):
+        """Cache {name: id}. Players that were not found are forgotten sooner."""
+        now = time.time()
+        found = {name: player_id for name, player_id in ids.items() if player_id != -1}
+        not_found = {name: player_id for name, player_id in ids.items() if player_id == -1}
+        for values, expires_at in [(found, now + PLAYER_ID_DURATION), (not_found, now + PLAYER_NOT_FOUND_DURATION)]:
+            if values:
+                get_backend().set_many(PLAYER_ID_NAMESPACE, values, expires_at)
+                for name, player_id in values.items():
+                    memory.set((PLAYER_ID_NAMESPACE, name), player_id, expires_at)
+
+    def _get_player_id_no_cache(self, player):
         url = self.base_url + "/player/player/findplayer.html"
         params = {"nofriends": "", "q": player, "start": 0, "count": "Infinity"}
         url += "?" + urllib.parse.urlencode(params)
@@ -429,15 +449,15 @@ class BGAAccount:
         return "Message sent"
 
     def get_game_info(self, game_name):
-        return cache_to_file(game_name, lambda: self._get_game_info_no_cache(game_name))
+        return cache_to_file(game_name, lambda: self._get_game_info_no_cache(game_name), namespace=GAME_INFO_NAMESPACE)
 
     def _get_game_info_no_cache(self, game_name):
-        response = self.post("https://boardgamearena.com/gamelist/gamelist/gameDetails.html", {"game": game_name}, headers={"X-Request-Token": self.request_token})
+        response = self.post(self.base_url + "/gamelist/gamelist/gameDetails.html", {"game": game_name}, headers={"X-Request-Token": self.request_token})
         if response.status_code != 200:
             raise Exception("Could not fetch game info for ${game_name=}")
 
         return response.json()["results"]
 
     def close_connection(self):
-        """Close the connection. aiohttp complains otherwise."""
-        self.session.close()
+        """Close the session. Its connections stay open for the other accounts."""
+        transport.close_session(self.session)
@@ -0,0 +1,79 @@
+"""Asyncio counterpart of BGAAccount.
+
+BGAAccount does blocking HTTP on a requests.Session. AsyncBGAAccount exposes the
+same methods as coroutines by running each call on a worker thread, so
+independent calls (resolving several invitees, fetching metadata for many
+tables, ...) overlap on one event loop instead of being a serial chain of
+round trips.
+"""
+import asyncio
+import functools
+import logging
+
+from .bga_account import BGAAccount
+
+logger = logging.getLogger(__name__)
+
+# How many requests one account may have in flight at the same time.
+DEFAULT_CONCURRENCY = 4
+
+
+class AsyncBGAAccount:
+    """Wrap a BGAAccount so that every method is awaitable.
+
+    `await account.login(...)`, `await account.create_table(...)`, ... behave
+    exactly like their BGAAccount counterparts. Attributes that are not
+    callable (base_url, request_token, session) are returned as is.
+    """
+
+    def __init__(self, account: BGAAccount, concurrency: int = DEFAULT_CONCURRENCY):
+        self.account = account
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    @classmethod
+    async def create(cls, concurrency: int = DEFAULT_CONCURRENCY):
+        """Build a new BGAAccount (which already does a request) off the loop."""
+        account = await asyncio.to_thread(BGAAccount)
+        return cls(account, concurrency)
+
+    def __getattr__(self, name):
+        attr = getattr(self.account, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            async with self._semaphore:
+                return await asyncio.to_thread(attr, *args, **kwargs)
+
+        return call
+
+    async def get_player_ids(self, players):
+        """Resolve several player names, cached ids first and the others concurrently.
+        Returns {name: id}, id is -1 if not found. Names whose lookup failed are left
+        out, the ids of the others are still cached."""
+        names = list(dict.fromkeys(players))
+        ids = await self.cached_player_ids(names)
+        missing = [name for name in names if name not in ids]
+        found = await asyncio.gather(*(self._get_player_id_no_cache(name) for name in missing), return_exceptions=True)
+        resolved = {}
+        for name, result in zip(missing, found):
+            if isinstance(result, Exception):
+                logger.warning(f"Could not look up player {name}: {result!r}")
+            else:
+                resolved[name] = result
+        await self.store_player_ids(resolved)
+        ids.update(resolved)
+        return {name: ids[name] for name in names if name in ids}
+
+    async def get_tables_metadata(self, tables):
+        """get_table_metadata for many tables. Returns {table id: (progress, moves, url)}."""
+        tables = list(tables)
+        results = await asyncio.gather(*(self.get_table_metadata(table) for table in tables))
+        return {table["id"]: result for table, result in zip(tables, results)}
+
+    async def invite_players(self, table_id, player_ids):
+        """Invite several players to a table. Returns {player id: error string}."""
+        player_ids = list(player_ids)
+        errors = await asyncio.gather(*(self.invite_player(table_id, player_id) for player_id in player_ids))
+        return dict(zip(player_ids, errors))
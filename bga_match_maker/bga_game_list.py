@@ -1,59 +1,206 @@
-"""Get/cache available games. Cache is bga_game_list.json."""
+"""Get/cache available games. Cached under the game_list namespace."""
+import bisect
+import codecs
 import json
 import logging
-from logging.handlers import RotatingFileHandler
-
-import requests
+import re
+import threading
 
+from . import http_cache, metrics, transport
 from .utils import normalize_name
-from .cache_to_file import cache
+from .cache_to_file import cache, peek
 
 logger = logging.getLogger(__name__)
 
 
-@cache("bga_game_list")
+# Fields of every game kept in the cached list, on top of id and codename
+GAME_FIELDS = ("display_name_en", "player_numbers")
+GAME_LIST_KEY = "bga_game_list"
+GAME_LIST_NAMESPACE = "game_list"
+# The game list is in the page as `globalUserInfos={...};`
+INFOS_MARKER = "globalUserInfos="
+
+_OUTSIDE_STRING = re.compile(r'[{}"]')
+_INSIDE_STRING = re.compile(r'["\\]')
+
+
+def extract_json_object(chunks, marker):
+    """Return the text of the json object that follows marker in a stream of
+    text chunks. The stream is not read further once the object is complete."""
+    chunks = (chunk for chunk in chunks if chunk)
+    buffer = ""
+    # Find the marker, keeping enough text to see it across two chunks
+    for chunk in chunks:
+        buffer += chunk
+        position = buffer.find(marker)
+        if position != -1:
+            buffer = buffer[position + len(marker):]
+            break
+        buffer = buffer[-len(marker):]
+    else:
+        raise Exception(f"Could not find {marker}")
+
+    while "{" not in buffer:
+        buffer = next(chunks, None)
+        if buffer is None:
+            raise Exception(f"No object after {marker}")
+    buffer = buffer[buffer.index("{"):]
+
+    parts = []
+    depth = 0
+    in_string = False
+    escaped = False
+    while True:
+        # When a chunk ended with a backslash, the escaped char starts this one
+        i = 1 if escaped else 0
+        escaped = False
+        while True:
+            match = (_INSIDE_STRING if in_string else _OUTSIDE_STRING).search(buffer, i)
+            if match is None:
+                break
+            char = match.group()
+            i = match.end()
+            if in_string:
+                if char == '"':
+                    in_string = False
+                elif i == len(buffer):
+                    escaped = True
+                else:
+                    i += 1
+            elif char == '"':
+                in_string = True
+            elif char == "{":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    parts.append(buffer[:i])
+                    return "".join(parts)
+        parts.append(buffer)
+        buffer = next(chunks, None)
+        if buffer is None:
+            raise Exception(f"Object after {marker} is truncated")
+
+
+def iter_text(response, chunk_size=64 * 1024):
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def project_game(game, fields=GAME_FIELDS):
+    projected = {"id": game["id"], "codename": game["name"]}
+    for field in fields:
+        if field in game:
+            projected[field] = game[field]
+    return projected
+
+
+@cache(GAME_LIST_KEY, namespace=GAME_LIST_NAMESPACE)
 def get_game_list():
     """Get the list of games and numbers BGA assigns to each game.
     The url below should be accessible unauthenticated (test with curl).
     """
-    url = "https://boardgamearena.com/gamelist?section=all"
-    with requests.Session() as session:
-        with session.get(url) as response:
-            if response.status_code >= 400:
-                # If there's a problem with getting the most accurate list, use cached version
-                raise Exception("Try to use cache for game list")
-            html = response.text
+    url = transport.base_url() + "/gamelist?section=all"
+    # Only the validators of the page are kept, the list itself is in this cache
+    key = http_cache.cache_key(None, url)
+    policy = http_cache.policy_for(url)
+    stored = http_cache.load(key)
+    previous = peek(GAME_LIST_KEY, GAME_LIST_NAMESPACE)
+    headers = http_cache.conditional_headers(stored) if stored is not None and previous is not None else {}
+    # The page is the same for everyone, reuse the connections of the cookie-less session
+    session = transport.shared_session()
+    with transport.send(session, "GET", url, stream=True, headers=headers) as response:
+        if headers and response.status_code == 304:
+            logger.debug("Game list not modified")
+            metrics.registry.inc("bga_cache_requests_total", namespace=http_cache.HTTP_NAMESPACE, result="revalidated")
+            http_cache.refresh(key, stored, policy)
+            return previous.value
+        if response.status_code >= 400:
+            # If there's a problem with getting the most accurate list, use cached version
+            raise Exception("Try to use cache for game list")
+
+        # Only read the page up to the end of globalUserInfos
+        infos = json.loads(extract_json_object(iter_text(response), INFOS_MARKER))
+        http_cache.save(key, response, None, policy)
+
+        return {game["display_name_en"]: project_game(game) for game in infos["game_list"]}
+
 
-            lines = html.splitlines()
+class GameCatalog:
+    """Index of a game list: exact lookups by normalized name, id or codename
+    and prefix lookups on normalized names."""
 
-            # Search a line defining the variable globalUserInfos=
-            infosLine = next(line for line in lines if "globalUserInfos=" in line)
+    def __init__(self, games):
+        self.by_name = {}
+        self.by_id = {}
+        self.by_codename = {}
+        for name, game in games.items():
+            self.by_name[normalize_name(name)] = game
+            self.by_id[int(game["id"])] = game
+            self.by_codename[game["codename"]] = game
+        self.sorted_names = sorted(self.by_name)
 
-            # Load the json object
-            # Start at first { and remove the last char (a ';')
-            infos = json.loads(infosLine[infosLine.index("{"):-1])
+    def lookup(self, game):
+        """Return the game matching exactly (once normalized) a name, an id or a codename, or None."""
+        game = str(game)
+        if game.isdigit() and int(game) in self.by_id:
+            return self.by_id[int(game)]
+        return self.by_name.get(normalize_name(game)) or self.by_codename.get(game)
 
-            game_list = infos["game_list"]
+    def prefix_matches(self, prefix):
+        """Normalized names starting with prefix, in alphabetical order."""
+        start = bisect.bisect_left(self.sorted_names, prefix)
+        matches = []
+        for name in self.sorted_names[start:]:
+            if not name.startswith(prefix):
+                break
+            matches.append(name)
+        return matches
 
-            games = {}
+    def resolve(self, game_name_part):
+        """Resolve a game like lookup() does (name, id or codename), then a partial
+        game name like race for raceforthegalaxy.
+        Returns (game, error string). game is None when there is an error."""
+        game = self.lookup(game_name_part)
+        if game is not None:
+            return game, ""
+        normalized = normalize_name(str(game_name_part))
+        games_found = self.prefix_matches(normalized)
+        if len(games_found) == 0:
+            err = (
+                f"`{normalized}` is not available on BGA. Check your spelling "
+                f"(capitalization and special characters do not matter)."
+            )
+            return None, err
+        elif len(games_found) > 1:
+            return None, f"`{normalized}` matches [{','.join(games_found)}]. Use more letters to match."
+        return self.by_name[games_found[0]], ""
 
-            for game in game_list:
-                name = game["display_name_en"]
-                id = game["id"]
-                codename = game["name"]
 
-                games[name] = {
-                    "id": id,
-                    "codename": codename,
-                    "full": game
-                }
+_catalog = None
+_catalog_lock = threading.Lock()
 
-            return games
+
+def get_game_catalog():
+    """GameCatalog of get_game_list(). It is only rebuilt when a new version of the list is loaded."""
+    global _catalog
+    games = get_game_list()
+    with _catalog_lock:
+        if _catalog is None or _catalog[0] is not games:
+            _catalog = (games, GameCatalog(games))
+        return _catalog[1]
+
+
+def get_cached_game_catalog():
+    """GameCatalog of the cached game list, even expired, without any request. None if it was never fetched."""
+    entry = peek(GAME_LIST_KEY, GAME_LIST_NAMESPACE)
+    if entry is None:
+        return None
+    return GameCatalog(entry.value)
 
 
 def is_game_valid(game):
     # Check if any words are games
-    games = get_game_list()
-    normalized_games = [normalize_name(g) for g in games]
-    normalized_game = normalize_name(game)
-    return normalized_game in normalized_games
+    return get_game_catalog().lookup(game) is not None
@@ -0,0 +1,210 @@
+"""Turn table options like {"speed": "1/2days", "Expansion": "On"} into the
+requests that set them on a table.
+
+compile_options validates the options of a game once and returns a plan of
+(option, path, params) steps. Plans are kept in memory, so matching and
+creating many tables with the same options does not redo the resolution. A plan
+with game specific options is compiled again when the game details change.
+"""
+import logging
+import threading
+import typing
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MODE_TYPES = {
+    "normal": 0,
+    "training": 1,
+}
+MODE_VALUES = list(MODE_TYPES.keys())
+SPEED_TYPES = {
+    "fast": 0,
+    "normal": 1,
+    "slow": 2,
+    "24/day": 10,
+    "12/day": 11,
+    "8/day": 12,
+    "4/day": 13,
+    "3/day": 14,
+    "2/day": 15,
+    "1/day": 17,
+    "1/2days": 19,
+    "nolimit": 20,
+}
+SPEED_VALUES = list(SPEED_TYPES.keys())
+KARMA_TYPES = {"0": 0, "50": 1, "65": 2, "75": 3, "85": 4}
+KARMA_VALUES = list(KARMA_TYPES.keys())
+LEVEL_VALUES = [
+    "beginner",
+    "apprentice",
+    "average",
+    "good",
+    "strong",
+    "expert",
+    "master",
+]
+
+DEFAULT_OPTIONS = {
+    "mode": "normal",
+    "presentation": "Made by the good bot"
+}
+CHANGE_OPTION_PATH = "/table/table/changeoption.html"
+RESTRICT_GROUP_PATH = "/table/table/restrictToGroup.html"
+# Options that are not set through changeoption.html
+TABLE_OPTIONS = ("mode", "minrep", "presentation", "levels", "players", "restrictgroup", "lang")
+
+PLAN_CACHE_SIZE = 1024
+# Details (options) of games from gameDetails.html, cached by codename
+GAME_INFO_NAMESPACE = "game_info"
+
+
+class OptionError(Exception):
+    """The message is meant for the user."""
+
+
+class OptionStep(typing.NamedTuple):
+    option: str
+    path: str
+    # None for restrictgroup: the group id depends on the account
+    params: typing.Optional[dict]
+
+
+class GameOptionIndex:
+    """Option name -> (option id, {value name: value id}) for one game."""
+
+    def __init__(self, game_info):
+        self.options = {}
+        for game_option in game_info["options"]:
+            values = {value["name"]: value["id"] for value in game_option["values"]}
+            # Like a linear search, the first option with a name wins
+            self.options.setdefault(game_option["name"], (game_option["id"], values))
+
+    def resolve(self, option, value):
+        """Return (option id, value id) or raise OptionError."""
+        option_id, values = self.options.get(option, (None, {}))
+        if option_id is None or value not in values:
+            logger.warning(f"Cannot set {option=} with {value=}")
+            raise OptionError(f"Option {option} not a valid option.")
+        return option_id, values[value]
+
+
+_indexes: typing.Dict[str, tuple] = {}
+# (game name, options) -> (plan, game details it was compiled with or None)
+_plans: typing.OrderedDict = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_option_index(game_name, game_info_loader):
+    """GameOptionIndex of a game, rebuilt only when a new version of its details is loaded."""
+    game_info = game_info_loader(game_name)
+    with _lock:
+        cached = _indexes.get(game_name)
+        if cached is None or cached[0] is not game_info:
+            cached = (game_info, GameOptionIndex(game_info))
+            _indexes[game_name] = cached
+        return cached[1]
+
+
+def clear_plans():
+    with _lock:
+        _plans.clear()
+        _indexes.clear()
+
+
+def compile_option(option, value, game_name, game_info_loader):
+    """Return the OptionStep of a single option or raise OptionError."""
+    logger.debug(f"Reading option `{option}` with key `{value}`")
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        raise OptionError(f"Option {option} must be a string or a number, not {value!r}.")
+    if option == "mode":
+        if value not in MODE_TYPES:
+            raise OptionError(f"Valid modes are training and normal. You entered {value}.")
+        return OptionStep(option, CHANGE_OPTION_PATH, {"id": 201, "value": MODE_TYPES[value]})
+    elif option == "speed":
+        if value not in SPEED_TYPES:
+            raise OptionError(f"{value} is not a valid speed. Check !bga options.")
+        return OptionStep(option, CHANGE_OPTION_PATH, {"id": 200, "value": SPEED_TYPES[value]})
+    elif option == "minrep":
+        if value not in KARMA_TYPES:
+            raise OptionError(f"Invalid minimum karma {value}. Valid values are 0, 50, 65, 75, 85.")
+        return OptionStep(option, "/table/table/changeTableAccessReputation.html", {"karma": KARMA_TYPES[value]})
+    elif option == "presentation":
+        # No error checking is necessary as every string is valid.
+        return OptionStep(option, "/table/table/setpresentation.html", {"value": value})
+    elif option == "levels":
+        if not isinstance(value, str) or value.count("-") != 1:
+            raise OptionError("levels requires one dash between two levels like `good-strong`.")
+        [min_level, max_level] = value.lower().split("-")
+        if min_level not in LEVEL_VALUES:
+            raise OptionError(f"Min level {min_level} is not a valid level ({','.join(LEVEL_VALUES)})")
+        if max_level not in LEVEL_VALUES:
+            raise OptionError(f"Max level {max_level} is not a valid level ({','.join(LEVEL_VALUES)})")
+        min_level_num = LEVEL_VALUES.index(min_level)
+        max_level_num = LEVEL_VALUES.index(max_level)
+        level_keys = {}
+        for i in range(7):
+            if min_level_num <= i <= max_level_num:
+                level_keys["level" + str(i)] = "true"
+            else:
+                level_keys["level" + str(i)] = "false"
+        return OptionStep(option, "/table/table/changeTableAccessLevel.html", level_keys)
+    elif option == "players":
+        # Change minimum and maximum number of players
+        return OptionStep(option, "/table/table/changeWantedPlayers.html", {"minp": value, "maxp": value})
+    elif option == "restrictgroup":
+        return OptionStep(option, RESTRICT_GROUP_PATH, None)
+    elif option == "lang":
+        return OptionStep(option, "/table/table/restrictToLanguage.html", {"lang": value})
+    elif option.isdigit():
+        # If this is an HTML option, set it as such
+        return OptionStep(option, CHANGE_OPTION_PATH, {"id": option, "value": value})
+    else:
+        option_id, value_id = get_option_index(game_name, game_info_loader).resolve(option, value)
+        return OptionStep(option, CHANGE_OPTION_PATH, {"id": option_id, "value": value_id})
+
+
+def compile_options(game_name, options, game_info_loader):
+    """Return the plan (a tuple of OptionStep) that sets options, defaults
+    included, on a table of game_name. Raise OptionError for invalid options.
+
+    game_info_loader(game_name) returns the game details from gameDetails.html,
+    it is only called for options specific to the game.
+    """
+    # options will overwrite defaults if they are there
+    updated_options = DEFAULT_OPTIONS | options
+    try:
+        key = (game_name, tuple(updated_options.items()))
+        hash(key)
+    except TypeError:
+        key = None
+
+    if key is not None:
+        with _lock:
+            cached = _plans.get(key)
+            if cached is not None:
+                _plans.move_to_end(key)
+        if cached is not None:
+            plan, game_info = cached
+            # Ids of game specific options come from the game details: the plan is
+            # only good for the version of the details it was compiled with.
+            if game_info is None or game_info_loader(game_name) is game_info:
+                return plan
+
+    used = []
+
+    def loader(name):
+        used.append(game_info_loader(name))
+        return used[-1]
+
+    plan = tuple(
+        compile_option(option, value, game_name, loader)
+        for option, value in updated_options.items()
+    )
+
+    if key is not None:
+        with _lock:
+            _plans[key] = (plan, used[-1] if used else None)
+            while len(_plans) > PLAN_CACHE_SIZE:
+                _plans.popitem(last=False)
+    return plan
@@ -1,48 +1,301 @@
-import os
-import time
+"""Cache results of slow calls (mostly requests to BGA).
+
+Entries are stored by a backend under a namespace and a key, with an expiry
+time. SQLiteBackend is the default backend: one database file instead of a json
+file per entry, safe to share between concurrent runs. A size bounded in memory
+LRU sits in front of the backend so repeated lookups in one process cost a dict
+access.
+
+Run `bga-match-maker-cache stats` or `bga-match-maker-cache prune` to inspect
+or clean the cache.
+"""
+import abc
+import argparse
 import json
 import logging
+import os
+import sqlite3
+import threading
+import time
+import typing
+from collections import OrderedDict
 from functools import wraps
 
+from . import metrics
+
 one_week = 604800
 logger = logging.getLogger(__name__)
 
+DEFAULT_PATH = "bga_cache.sqlite3"
+DEFAULT_NAMESPACE = "default"
+
+# In memory tier, in front of the backend
+MEMORY_TTL = 300
+MEMORY_SIZE = 1024
+# How long a stale entry is served from memory before trying to fetch again
+STALE_TTL = 60
+
+_MISSING = object()
+
+
+class CacheEntry(typing.NamedTuple):
+    value: typing.Any
+    stored_at: float
+    expires_at: float
+
+    @property
+    def is_fresh(self):
+        return time.time() < self.expires_at
+
+
+class CacheBackend(abc.ABC):
+    """Where entries are persisted. Expired entries are still returned by get,
+    so callers can fall back to them when a refresh fails."""
+
+    def get(self, namespace: str, key: str) -> typing.Optional[CacheEntry]:
+        return self.get_many(namespace, [key]).get(key)
+
+    @abc.abstractmethod
+    def get_many(self, namespace: str, keys: typing.Iterable[str]) -> typing.Dict[str, CacheEntry]:
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value, expires_at: float):
+        self.set_many(namespace, {key: value}, expires_at)
+
+    @abc.abstractmethod
+    def set_many(self, namespace: str, values: typing.Dict[str, typing.Any], expires_at: float):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, namespace: str, key: typing.Optional[str] = None):
+        """Delete one entry, or the whole namespace when key is None."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def prune(self) -> int:
+        """Delete expired entries and return how many were deleted."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def stats(self) -> typing.List[dict]:
+        """One dict per namespace with its number of entries, expired entries and size."""
+        raise NotImplementedError
+
+
+class SQLiteBackend(CacheBackend):
+    """Entries are compact json in one table, keyed by (namespace, key)."""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            if path != ":memory:":
+                # Readers of other runs are not blocked while this one writes
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " stored_at REAL NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+
+    def get_many(self, namespace, keys):
+        keys = list(keys)
+        entries = {}
+        # Stay under the maximum number of sqlite variables
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            with self.lock:
+                rows = self.connection.execute(
+                    f"SELECT key, value, stored_at, expires_at FROM cache WHERE namespace = ? AND key IN ({placeholders})",
+                    [namespace, *chunk],
+                ).fetchall()
+            for key, value, stored_at, expires_at in rows:
+                entries[key] = CacheEntry(json.loads(value), stored_at, expires_at)
+        return entries
+
+    def set_many(self, namespace, values, expires_at):
+        now = time.time()
+        rows = [
+            (namespace, key, json.dumps(value, separators=(",", ":")), now, expires_at)
+            for key, value in values.items()
+        ]
+        with self.lock:
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE")
+                self.connection.executemany(
+                    "INSERT INTO cache (namespace, key, value, stored_at, expires_at) VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT (namespace, key) DO UPDATE SET"
+                    " value = excluded.value, stored_at = excluded.stored_at, expires_at = excluded.expires_at",
+                    rows,
+                )
+
+    def delete(self, namespace, key=None):
+        with self.lock:
+            if key is None:
+                self.connection.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+            else:
+                self.connection.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
 
-def cache_to_file(key: str, func, *args, **kwargs):
-    return cache(key)(func)(*args, **kwargs)
+    def prune(self):
+        with self.lock:
+            cursor = self.connection.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            return cursor.rowcount
 
+    def stats(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT namespace, COUNT(*), SUM(expires_at <= ?), SUM(LENGTH(value))"
+                " FROM cache GROUP BY namespace ORDER BY namespace",
+                (time.time(),),
+            ).fetchall()
+        return [
+            {"namespace": namespace, "entries": entries, "expired": expired, "bytes": size}
+            for namespace, entries, expired, size in rows
+        ]
 
-def cache(key: str, cache_duration: int = one_week):
-    filename = key+".json"
 
-    def read():
-        if not os.path.exists(filename):
-            raise Exception(f"{filename} does not exist")
+_backend: typing.Optional[CacheBackend] = None
+_backend_lock = threading.Lock()
 
-        with open(filename, "r") as file:
-            logger.debug(f"Loading ${key=} from cache")
-            return json.load(file)
 
-    def write(content):
-        with open(filename, "w") as file:
-            logger.debug(f"Writing ${key=} to cache")
-            json.dump(content, file , indent=2)
+def set_backend(backend: CacheBackend):
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    memory.invalidate()
+
+
+def get_backend() -> CacheBackend:
+    """The backend in use, a SQLiteBackend on DEFAULT_PATH unless set_backend was called."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = SQLiteBackend()
+        return _backend
+
+
+class MemoryCache:
+    """Size bounded LRU of {key: value} where every entry has an expiry time."""
+
+    def __init__(self, max_size=MEMORY_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=_MISSING):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+
+memory = MemoryCache()
+
+
+def set_memory_ttl(seconds):
+    """How long values stay in memory at most. Long running processes can keep them longer."""
+    global MEMORY_TTL
+    MEMORY_TTL = seconds
+
+
+def invalidate(key=None, namespace=DEFAULT_NAMESPACE, persistent=False):
+    """Forget key (or everything) from memory. With persistent, remove it from the backend too."""
+    memory.invalidate(None if key is None else (namespace, key))
+    if persistent and key is not None:
+        get_backend().delete(namespace, key)
+
+
+def peek(key: str, namespace: str = DEFAULT_NAMESPACE) -> typing.Optional[CacheEntry]:
+    """The entry of key in the backend, even expired, without ever fetching it. None if not cached."""
+    return get_backend().get(namespace, key)
+
+
+def cache_to_file(key: str, func, *args, namespace: str = DEFAULT_NAMESPACE, **kwargs):
+    return cache(key, namespace=namespace)(func)(*args, **kwargs)
+
+
+def cache(key: str, cache_duration: int = one_week, namespace: str = DEFAULT_NAMESPACE):
+    memory_key = (namespace, key)
 
     def decorator(f):
 
         @wraps(f)
         def replacement(*args, **kwargs):
-            if os.path.exists(filename) and time.time() - cache_duration < os.path.getmtime(filename):
-                return read()
+            result = memory.get(memory_key)
+            if result is not _MISSING:
+                metrics.registry.inc("bga_cache_requests_total", namespace=namespace, result="memory")
+                return result
+
+            backend = get_backend()
+            now = time.time()
+            entry = backend.get(namespace, key)
+            if entry is not None and entry.is_fresh:
+                logger.debug(f"Loading ${key=} from cache")
+                metrics.registry.inc("bga_cache_requests_total", namespace=namespace, result="hit")
+                result = entry.value
+                expires_at = entry.expires_at
             else:
                 try:
                     result = f(*args, **kwargs)
-                    write(result)
-                    return result
+                    expires_at = now + cache_duration
+                    logger.debug(f"Writing ${key=} to cache")
+                    backend.set(namespace, key, result, expires_at)
+                    metrics.registry.inc("bga_cache_requests_total", namespace=namespace, result="miss")
                 except Exception:
                     logger.warning(f"Could not fetch a new version of cache ${key=}")
-                    return read()
+                    if entry is None:
+                        metrics.registry.inc("bga_cache_requests_total", namespace=namespace, result="miss")
+                        raise
+                    metrics.registry.inc("bga_cache_requests_total", namespace=namespace, result="stale")
+                    result = entry.value
+                    expires_at = now + STALE_TTL
+
+            memory.set(memory_key, result, min(expires_at, now + MEMORY_TTL))
+            return result
 
         return replacement
 
     return decorator
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bga-match-maker-cache")
+    parser.add_argument("--cache-path", default=DEFAULT_PATH)
+    parser.add_argument("command", choices=["stats", "prune"])
+    args = parser.parse_args()
+
+    if not os.path.exists(args.cache_path):
+        print(f"No cache at {args.cache_path}")
+        return
+    backend = SQLiteBackend(args.cache_path)
+
+    if args.command == "prune":
+        print(f"Deleted {backend.prune()} expired entries")
+    for stat in backend.stats():
+        print(f"{stat['namespace']:<20} entries={stat['entries']} expired={stat['expired']} bytes={stat['bytes']}")
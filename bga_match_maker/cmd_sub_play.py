@@ -4,7 +4,7 @@ from bga_game_list import is_game_valid
 from bga_create_game import setup_bga_game
 from discord_utils import send_options_embed, send_simple_embed
 from cmd_sub_setup import ctx_bga_options_menu, ctx_bga_parse_options
-from bga_account import MODE_VALUES, SPEED_VALUES, KARMA_VALUES, LEVEL_VALUES
+from bga_options import MODE_VALUES, SPEED_VALUES, KARMA_VALUES, LEVEL_VALUES
 from utils import reset_context
 
 
@@ -1,6 +1,7 @@
 import json
 
-from bga_account import BGAAccount, SPEED_VALUES, MODE_VALUES, LEVEL_VALUES, KARMA_VALUES
+from bga_options import SPEED_VALUES, MODE_VALUES, LEVEL_VALUES, KARMA_VALUES
+from bga_account_async import AsyncBGAAccount
 from bga_game_list import is_game_valid
 from creds_iface import get_all_logins
 from discord_utils import send_options_embed
@@ -32,9 +33,10 @@ async def ctx_setup(message, contexts, args):
             await message.channel.send("You must first enter your username before entering a password.")
             contexts[str(message.author)]["context"] = "setup"
             return
-        account = BGAAccount()
+        account = await AsyncBGAAccount.create()
         login_successful = await account.login(logins[str(message.author.id)]["username"], message.content)
         await account.logout()
+        await account.close_connection()
         if login_successful:
             save_data(message.author.id, password=message.content)
             await message.channel.send("BGA username/password verified and password saved.")
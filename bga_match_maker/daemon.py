@@ -0,0 +1,166 @@
+"""Keep running and reconcile every creator on its own schedule.
+
+Accounts stay logged in between reconciles and the game catalog, game details
+and player ids stay in memory, so a reconcile only costs the requests it really
+needs. users.json and the operations file are reloaded when they change. The
+state of every creator can be written to a json file (--status-path).
+"""
+import heapq
+import logging
+import os
+import random
+import signal
+import sys
+import time
+from dataclasses import dataclass
+
+from . import metrics
+from .cache_to_file import one_week, set_memory_ttl
+from .main import CreatorReport, close_account, load_operations, open_account, reconcile
+from .session_store import JsonStore
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Seconds between two checks for changed configuration files
+RELOAD_CHECK = 5
+# A reconcile is delayed by up to this fraction of the interval
+JITTER = 0.1
+# Check that a kept session is still logged in when it was not used for that long
+SESSION_CHECK_INTERVAL = 1800
+
+
+@dataclass
+class WarmAccount:
+    account: object
+    player_id: int
+    verified_at: float
+
+
+class Daemon:
+    def __init__(self, config, session_store=None, run_state=None):
+        self.config = config
+        self.session_store = session_store
+        self.run_state = run_state
+        self.status = JsonStore(config.status_path) if config.status_path else None
+        self.users = {}
+        self.op_per_creater = {}
+        self.accounts = {}
+        # Heap of (time of next reconcile, creator)
+        self.schedule = []
+        self.mtimes = None
+        # Cached values are kept in memory as long as they are fresh
+        set_memory_ttl(one_week)
+
+    def next_run(self, creator):
+        user = self.users[creator]
+        interval = user.interval or self.config.interval
+        return time.time() + interval + random.uniform(0, JITTER * interval)
+
+    def reload_if_changed(self):
+        try:
+            mtimes = (os.path.getmtime(self.config.users_path), os.path.getmtime(self.config.operations_path))
+            if mtimes == self.mtimes:
+                return
+            self.mtimes = mtimes
+            users, op_per_creater, errors = load_operations(self.config)
+        except OSError as e:
+            # Like while an editor replaces the file, try again on the next tick
+            logger.warning(f"Keeping the previous configuration, could not read it: {e}")
+            self.mtimes = None
+            return
+        except Exception as e:
+            logger.exception(e)
+            return
+        if len(errors) > 0:
+            logger.error(f"Keeping the previous configuration, the new one has errors: {errors}")
+            return
+        logger.info("Configuration loaded")
+
+        for creator in set(self.op_per_creater) - set(op_per_creater):
+            self.drop_account(creator)
+            if self.status is not None:
+                self.status.forget(creator)
+        self.users = users
+        self.op_per_creater = op_per_creater
+
+        self.schedule = [(when, creator) for when, creator in self.schedule if creator in op_per_creater]
+        scheduled = {creator for _, creator in self.schedule}
+        for creator in op_per_creater:
+            if creator not in scheduled:
+                # Spread the first reconciles a little
+                self.schedule.append((time.time() + random.uniform(0, RELOAD_CHECK), creator))
+        heapq.heapify(self.schedule)
+
+    def get_account(self, user):
+        warm = self.accounts.get(user.name)
+        if warm is not None and time.time() - warm.verified_at > SESSION_CHECK_INTERVAL:
+            if warm.account.verify_privileged():
+                warm.verified_at = time.time()
+            else:
+                logger.info(f"Session of {user.name} expired")
+                self.drop_account(user.name)
+                warm = None
+        if warm is None:
+            account, player_id = open_account(user, self.session_store)
+            warm = WarmAccount(account, player_id, time.time())
+            self.accounts[user.name] = warm
+        return warm
+
+    def drop_account(self, creator):
+        warm = self.accounts.pop(creator, None)
+        if warm is not None:
+            try:
+                close_account(warm.account, self.users[creator], warm.player_id, self.session_store)
+            except Exception as e:
+                logger.exception(e)
+
+    def reconcile(self, creator):
+        user = self.users[creator]
+        try:
+            warm = self.get_account(user)
+            report = reconcile(warm.account, warm.player_id, user, self.op_per_creater[creator],
+                               self.config.dry_run, self.run_state)
+        except Exception as e:
+            logger.exception(e)
+            report = CreatorReport(creator, errors=[str(e)])
+            # The session may be what is broken, start from a new one next time
+            self.drop_account(creator)
+        logger.info(report.summary())
+        return report
+
+    def run(self):
+        # Stop cleanly (and save the sessions) on SIGTERM too
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        logger.info("Daemon started")
+        try:
+            while True:
+                self.reload_if_changed()
+                if not self.schedule:
+                    time.sleep(RELOAD_CHECK)
+                    continue
+                when, creator = self.schedule[0]
+                wait = when - time.time()
+                if wait > 0:
+                    time.sleep(min(wait, RELOAD_CHECK))
+                    continue
+                heapq.heappop(self.schedule)
+                report = self.reconcile(creator)
+                next_run = self.next_run(creator)
+                heapq.heappush(self.schedule, (next_run, creator))
+                if self.config.metrics_path:
+                    metrics.registry.write_prometheus(self.config.metrics_path)
+                if self.status is not None:
+                    self.status.save(creator, {
+                        "last_run": time.time(),
+                        "next_run": next_run,
+                        "summary": report.summary(),
+                        "errors": report.errors,
+                        "logged_in": creator in self.accounts,
+                    })
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logger.info("Daemon stopping")
+            for creator in list(self.accounts):
+                self.drop_account(creator)
@@ -0,0 +1,298 @@
+"""A small local stand-in for boardgamearena.com.
+
+It implements the endpoints bga-match-maker uses, keeps tables in memory and can
+add latency and errors to every response. Start it, then point the tool at it:
+
+    python -m bga_match_maker.fake_bga --port 8080 --latency 0.05 --error-rate 0.01
+    bga-match-maker --base-url http://localhost:8080 --users-path ... --operations-path ...
+
+Every user exists, logs in with any password and belongs to the "My friends"
+group. Player names starting with "unknown" do not exist.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TOKEN = "0123456789abcdef"
+SESSION_COOKIE = "TournoiEnLigneidt"
+
+GAMES = [
+    {"id": 1, "name": "yahtzee", "display_name_en": "Yahtzee", "player_numbers": [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]},
+    {"id": 2, "name": "wingspan", "display_name_en": "Wingspan", "player_numbers": [1, 2, 3, 4, 5]},
+    {"id": 3, "name": "raceforthegalaxy", "display_name_en": "Race for the Galaxy", "player_numbers": [2, 3, 4]},
+    {"id": 4, "name": "carcassonne", "display_name_en": "Carcassonne", "player_numbers": [2, 3, 4, 5]},
+]
+GAME_OPTIONS = [
+    {"id": 100, "name": "Expansion", "values": [{"id": 0, "name": "Off"}, {"id": 1, "name": "On"}]},
+    {"id": 101, "name": "Variant", "values": [{"id": 1, "name": "Standard"}, {"id": 2, "name": "Advanced"}]},
+]
+GROUPS = [("0", "-"), ("1001", "My friends")]
+# Default value of the options of a new table
+DEFAULT_TABLE_OPTIONS = {"200": "1", "201": "0", "100": "0", "101": "1"}
+
+
+def player_id(name):
+    return str(int(hashlib.sha256(name.lower().encode()).hexdigest()[:7], 16))
+
+
+class FakeBGA:
+    """State of the fake server: sessions and tables."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.tables = {}
+        # Player id -> name of the players that were looked up
+        self.names = {}
+        self.table_ids = itertools.count(100000)
+        self.requests = 0
+        # TCP connections opened by clients, to check that they are reused
+        self.connections = 0
+
+    def new_table(self, creator, game):
+        with self.lock:
+            table_id = str(next(self.table_ids))
+            self.tables[table_id] = {
+                "id": table_id,
+                "game_id": str(game["id"]),
+                "game_name": game["name"],
+                "gameserver": "1",
+                "status": "play",
+                "table_creator": player_id(creator),
+                "max_player": str(max(game["player_numbers"])),
+                "players": {player_id(creator): {"fullname": creator}},
+                "options": dict(DEFAULT_TABLE_OPTIONS),
+            }
+            return table_id
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "FakeBGA/1.0"
+    # Keep-alive, like BGA. Headers and body are written separately, without
+    # Nagle's algorithm they do not wait for the ack of the other.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    @property
+    def bga(self) -> FakeBGA:
+        return self.server.bga
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def setup(self):
+        super().setup()
+        with self.bga.lock:
+            self.bga.connections += 1
+
+    def do_GET(self):
+        self.handle_request({})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode()
+        self.handle_request(dict(urllib.parse.parse_qsl(body, keep_blank_values=True)))
+
+    def user(self):
+        cookies = self.headers.get("Cookie", "")
+        for cookie in cookies.split(";"):
+            name, _, value = cookie.strip().partition("=")
+            if name == SESSION_COOKIE:
+                return self.bga.sessions.get(value)
+        return None
+
+    def handle_request(self, form):
+        with self.bga.lock:
+            self.bga.requests += 1
+        if self.bga.latency:
+            time.sleep(self.bga.latency)
+        if self.bga.random.random() < self.bga.error_rate:
+            return self.reply(500, "text/plain", "Injected error")
+
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        params.update(form)
+        handler = ROUTES.get(url.path)
+        if handler is None:
+            if url.path.startswith("/table/table/"):
+                handler = Handler.table_change
+            else:
+                # Game pages, /{gameserver}/{game}?table=...
+                handler = Handler.game_page
+        handler(self, params)
+
+    def reply(self, status, content_type, body, headers=None):
+        data = body.encode()
+        if status == 200 and self.command == "GET":
+            # Answer 304 when the client already has this version of the response
+            etag = '"' + hashlib.sha256(data).hexdigest()[:16] + '"'
+            headers = dict(headers or {}, ETag=etag)
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+        self.send_response(status)
+        self.send_header("Content-Type", content_type + "; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def reply_json(self, content, headers=None):
+        self.reply(200, "application/json", json.dumps(content), headers)
+
+    def reply_html(self, content):
+        self.reply(200, "text/html", f"<html><body>{content}</body></html>")
+
+    def account(self, params):
+        self.reply_html(f"<script>var config = {{ requestToken: '{REQUEST_TOKEN}', }};</script>")
+
+    def login(self, params):
+        token = hashlib.sha256(f"{params.get('email')}{time.time()}".encode()).hexdigest()[:16]
+        with self.bga.lock:
+            self.bga.sessions[token] = params.get("email")
+        self.reply_json({"status": 1, "data": {"success": True}}, {"Set-Cookie": f"{SESSION_COOKIE}={token}; Path=/"})
+
+    def logout(self, params):
+        self.reply_json({"status": 1, "data": "ok"}, {"Set-Cookie": f"{SESSION_COOKIE}=deleted; Path=/; Max-Age=0"})
+
+    def community(self, params):
+        if self.user() is None:
+            return self.reply_html("You must be logged in to see this page.")
+        self.reply_html("Community")
+
+    def player_page(self, params):
+        self.reply_html("Player")
+
+    def find_player(self, params):
+        name = params.get("q", "")
+        if name.lower().startswith("unknown"):
+            return self.reply_json({"items": []})
+        with self.bga.lock:
+            self.bga.names[player_id(name)] = name
+        self.reply_json({"items": [{"id": player_id(name), "fullname": name}]})
+
+    def table_infos_list(self, params):
+        player = params.get("playerfilter")
+        with self.bga.lock:
+            tables = {
+                table_id: table for table_id, table in self.bga.tables.items()
+                if player is None or player in table["players"]
+            }
+        self.reply_json({"status": 1, "data": {"tables": tables}})
+
+    def table_infos(self, params):
+        table = self.bga.tables.get(params.get("id"))
+        if table is None:
+            return self.reply_json({"status": "0", "error": "Unknown table"})
+        options = {option_id: {"value": value} for option_id, value in table["options"].items()}
+        self.reply_json({"status": 1, "data": {"id": table["id"], "options": options}})
+
+    def create_table(self, params):
+        user = self.user()
+        if user is None:
+            return self.reply_json({"status": "0", "error": "You must be logged in"})
+        game = next((game for game in GAMES if str(game["id"]) == params.get("game")), None)
+        if game is None:
+            return self.reply_json({"status": "0", "error": "Unknown game"})
+        table_id = self.bga.new_table(user, game)
+        self.reply_json({"status": "1", "data": {"table": table_id}})
+
+    def table_change(self, params):
+        table = self.bga.tables.get(params.get("table"))
+        if table is None:
+            return self.reply_json({"status": "0", "error": "Unknown table"})
+        path = urllib.parse.urlsplit(self.path).path
+        with self.bga.lock:
+            if path == "/table/table/changeoption.html":
+                table["options"][str(params["id"])] = str(params["value"])
+            elif path == "/table/table/changeWantedPlayers.html":
+                table["max_player"] = str(params["maxp"])
+            elif path == "/table/table/invitePlayer.html":
+                invited = params["player"]
+                table["players"][invited] = {"fullname": self.bga.names.get(invited, invited)}
+        self.reply_json({"status": "1", "data": "ok"})
+
+    def table_page(self, params):
+        options = "".join(f'<option value="{group_id}">{name}</option>' for group_id, name in GROUPS)
+        self.reply_html(f'<select id="restrictToGroup">{options}</select>')
+
+    def game_page(self, params):
+        self.reply_html('{"updateGameProgression":"42","move_nbr":"17"}')
+
+    def game_list(self, params):
+        infos = json.dumps({"game_list": GAMES})
+        self.reply_html(f"<script>\nvar a = 1;\nglobalUserInfos={infos};\n</script>")
+
+    def game_details(self, params):
+        self.reply_json({"status": 1, "results": {"name": params.get("game"), "options": GAME_OPTIONS}})
+
+    def ok(self, params):
+        self.reply_json({"status": 1, "data": "ok"})
+
+
+ROUTES = {
+    "/account": Handler.account,
+    "/account/account/login.html": Handler.login,
+    "/account/account/logout.html": Handler.logout,
+    "/community": Handler.community,
+    "/player": Handler.player_page,
+    "/player/player/findplayer.html": Handler.find_player,
+    "/tablemanager/tablemanager/tableinfos.html": Handler.table_infos_list,
+    "/table/table/tableinfos.html": Handler.table_infos,
+    "/table/table/createnew.html": Handler.create_table,
+    "/table": Handler.table_page,
+    "/gamelist": Handler.game_list,
+    "/gamelist/gamelist/gameDetails.html": Handler.game_details,
+    "/group/group/removeAllFromGameSession.html": Handler.ok,
+    "/community/community/addToFriend.html": Handler.ok,
+}
+
+
+def make_server(host="localhost", port=0, latency=0.0, error_rate=0.0, seed=None):
+    """A ThreadingHTTPServer serving a new FakeBGA. Port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.bga = FakeBGA(latency, error_rate, seed)
+    return server
+
+
+def start_in_thread(**kwargs):
+    """Start a server in a daemon thread and return it. Its url is f"http://localhost:{server.server_port}"."""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="fake-bga")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default=8080, type=int)
+    parser.add_argument("--latency", default=0.0, type=float, help="Seconds added to every response")
+    parser.add_argument("--error-rate", default=0.0, type=float, help="Fraction of requests answered with a 500")
+    parser.add_argument("--seed", default=None, type=int, help="Seed of the error injection")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.error_rate, args.seed)
+    print(f"Fake BGA listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Record exchanges with BGA as fixtures and replay them (--record, --replay).
+
+Fixtures contain the responses as sent by BGA, session cookies included, so
+they are only readable by their owner. Request bodies (which can hold a
+password) are only kept as a hash.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import urllib.parse
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from .transport import VOLATILE_PARAMS
+
+
+def request_key(request):
+    """Identify a request independently of the cache busting parameters."""
+    url = urllib.parse.urlsplit(request.url)
+    query = sorted((k, v) for k, v in urllib.parse.parse_qsl(url.query, keep_blank_values=True) if k not in VOLATILE_PARAMS)
+    key = f"{request.method} {url.path}?{urllib.parse.urlencode(query)}"
+    body = request.body or b""
+    if isinstance(body, str):
+        body = body.encode()
+    if body:
+        form = sorted((k, v) for k, v in urllib.parse.parse_qsl(body.decode(errors="replace")) if k not in VOLATILE_PARAMS)
+        key += " " + hashlib.sha256(urllib.parse.urlencode(form).encode()).hexdigest()[:16]
+    return key
+
+
+class Fixtures:
+    """A directory with one json file per recorded exchange."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.exchanges = {}
+        self.replayed = {}
+        if os.path.isdir(directory):
+            for filename in sorted(os.listdir(directory)):
+                if filename.endswith(".json"):
+                    with open(os.path.join(directory, filename)) as f:
+                        exchange = json.load(f)
+                    self.exchanges.setdefault(exchange["key"], []).append(exchange)
+        self.count = sum(len(exchanges) for exchanges in self.exchanges.values())
+
+    def add(self, request, response):
+        exchange = {
+            "key": request_key(request),
+            "url": request.url,
+            "status": response.status_code,
+            "headers": dict(response.headers),
+            "body": response.content.decode(response.encoding or "utf-8", errors="replace"),
+        }
+        # The body is stored decoded
+        for header in ("Content-Encoding", "Content-Length", "Transfer-Encoding"):
+            exchange["headers"].pop(header, None)
+        with self.lock:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            self.count += 1
+            # Responses hold the login cookies: keep them private, like the session store
+            fd = os.open(os.path.join(self.directory, f"{self.count:06d}.json"), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(exchange, f, indent=2)
+
+    def next(self, request):
+        """The next recorded exchange for request. The last one is repeated once all were replayed."""
+        key = request_key(request)
+        with self.lock:
+            exchanges = self.exchanges.get(key)
+            if not exchanges:
+                raise requests.ConnectionError(f"No fixture for {key}", request=request)
+            index = self.replayed.get(key, 0)
+            self.replayed[key] = index + 1
+            return exchanges[min(index, len(exchanges) - 1)]
+
+
+class RecordingAdapter(HTTPAdapter):
+    def __init__(self, fixtures, **kwargs):
+        super().__init__(**kwargs)
+        self.fixtures = fixtures
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        self.fixtures.add(request, response)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    def __init__(self, fixtures):
+        super().__init__()
+        self.fixtures = fixtures
+
+    def send(self, request, **kwargs):
+        exchange = self.fixtures.next(request)
+        response = requests.Response()
+        response.status_code = exchange["status"]
+        response.headers = CaseInsensitiveDict(exchange["headers"])
+        response.encoding = get_encoding_from_headers(response.headers) or "utf-8"
+        response._content = exchange["body"].encode(response.encoding)
+        response._content_consumed = True
+        # Streamed responses (stream=True) are closed through raw
+        response.raw = io.BytesIO(response._content)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+_fixtures = {}
+_fixtures_lock = threading.Lock()
+
+
+def get_fixtures(directory):
+    """Fixtures are shared by every session so that recordings are numbered in order."""
+    with _fixtures_lock:
+        if directory not in _fixtures:
+            _fixtures[directory] = Fixtures(directory)
+        return _fixtures[directory]
@@ -0,0 +1,32 @@
+"""BGA groups of an account, that tables can be restricted to."""
+import bisect
+
+# Groups an account is a member of, to restrict tables to them
+GROUPS_NAMESPACE = "groups"
+GROUPS_DURATION = 24 * 3600
+# A group that is not found is looked for again in groups read from BGA at least this long ago
+GROUPS_REFRESH_AFTER = 60
+
+
+class GroupIndex:
+    """Groups of an account, looked up by name or by the start of a name."""
+
+    def __init__(self, group_options):
+        self.group_options = [tuple(group_o) for group_o in group_options]
+        # Sorted (name, position in the page, id) for bisect
+        self.sorted_groups = sorted((name, i, group_id) for i, (group_id, name) in enumerate(self.group_options))
+
+    def find(self, name):
+        """Id of the group called name, else of the last group (in page order) starting with name. -1 if none."""
+        start = bisect.bisect_left(self.sorted_groups, (name,))
+        matches = []
+        for group_name, position, group_id in self.sorted_groups[start:]:
+            if not group_name.startswith(name):
+                break
+            if group_name == name:
+                return group_id
+            matches.append((position, group_id))
+        return max(matches)[1] if matches else -1
+
+    def names(self):
+        return [group_o[1] for group_o in self.group_options if group_o[1] != "-"]
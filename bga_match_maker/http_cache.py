@@ -0,0 +1,101 @@
+"""Cache of the responses of BGA, revalidated with conditional GETs.
+
+BGAAccount.fetch stores the body of a response with its validators (ETag,
+Last-Modified) in the "http" namespace of the cache backend. A stored response
+is served without any request while it is fresh, then it is revalidated: BGA
+answers 304 Not Modified when it did not change, which costs a request but not
+the download of the page.
+
+How long a response is fresh depends on the endpoint (see POLICIES). Responses
+depend on the logged in account, so they are stored by account (and not at all
+for a session resumed without its username). Requests that change something on
+BGA (login, table mutations) are never cached.
+"""
+import time
+import typing
+import urllib.parse
+
+from .cache_to_file import get_backend
+from .rate_limiter import LOOKUP, endpoint_class
+from .transport import VOLATILE_PARAMS
+
+HTTP_NAMESPACE = "http"
+
+
+class Policy(typing.NamedTuple):
+    # Seconds a stored response is used without asking BGA
+    fresh_for: float = 0
+    # Seconds the response and its validators are kept to revalidate it
+    keep_for: float = 7 * 24 * 3600
+
+
+# Endpoints cached by default, by path. Tables and groups change at any time,
+# so they are always revalidated.
+POLICIES = {
+    "/gamelist": Policy(fresh_for=24 * 3600),
+    "/table": Policy(),
+    "/tablemanager/tablemanager/tableinfos.html": Policy(),
+    "/table/table/tableinfos.html": Policy(),
+}
+# For the endpoints without a policy when a caller asks for the cache
+DEFAULT_POLICY = Policy()
+
+
+def policy_for(url, cache=None):
+    """Policy of url, or None if it must not be cached. cache=False never
+    caches, cache=True caches even endpoints without a policy."""
+    if cache is False or endpoint_class(url) != LOOKUP:
+        return None
+    policy = POLICIES.get(urllib.parse.urlsplit(url).path)
+    if policy is None and cache:
+        return DEFAULT_POLICY
+    return policy
+
+
+def cache_key(username, url):
+    """Key of url for username, without the cache busting parameters. username
+    is None only for the pages that are the same for everyone, like the game list."""
+    url = urllib.parse.urlsplit(url)
+    query = sorted((k, v) for k, v in urllib.parse.parse_qsl(url.query, keep_blank_values=True) if k not in VOLATILE_PARAMS)
+    return f"{username or ''} {url.path}?{urllib.parse.urlencode(query)}"
+
+
+def load(key):
+    """The stored response of key: {"body", "etag", "last_modified", "fetched_at"}, or None."""
+    entry = get_backend().get(HTTP_NAMESPACE, key)
+    if entry is None or not entry.is_fresh:
+        return None
+    return entry.value
+
+
+def is_fresh(stored, policy):
+    return stored["body"] is not None and time.time() < stored["fetched_at"] + policy.fresh_for
+
+
+def conditional_headers(stored):
+    """Headers asking BGA to answer 304 if the stored response did not change."""
+    headers = {}
+    if stored.get("etag"):
+        headers["If-None-Match"] = stored["etag"]
+    if stored.get("last_modified"):
+        headers["If-Modified-Since"] = stored["last_modified"]
+    return headers
+
+
+def save(key, response, body, policy):
+    """Store a 200 response. body can be None to only keep the validators. Responses
+    without validators are only stored if the policy lets them be fresh for a while."""
+    stored = {
+        "body": body,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "fetched_at": time.time(),
+    }
+    if stored["etag"] or stored["last_modified"] or (policy.fresh_for and body is not None):
+        get_backend().set(HTTP_NAMESPACE, key, stored, time.time() + max(policy.keep_for, policy.fresh_for))
+
+
+def refresh(key, stored, policy):
+    """BGA answered 304: the stored response is fresh again."""
+    stored = dict(stored, fetched_at=time.time())
+    get_backend().set(HTTP_NAMESPACE, key, stored, time.time() + max(policy.keep_for, policy.fresh_for))
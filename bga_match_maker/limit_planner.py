@@ -0,0 +1,141 @@
+"""Choose which operations to create so that every limit is filled.
+
+Limits of an operations file are nested: the limits of an operation are the
+chain of limits of its parents, outermost first. So they form a forest where an
+operation counts toward its innermost limit and all the limits above it. A
+limit can never go over its target.
+
+The plan satisfies (fills up to their target) as many limits as possible, then
+creates as many tables as possible. It is a dynamic program on the tree: for
+every limit and every number of tables created under it, the most limits that
+can be satisfied under it, from a knapsack merge of its children and its own
+operations. Tables are then handed out top-down. When the limits are not nested
+(should not happen with Config.operations), the plan falls back to a greedy
+fill in file order, which does not give that guarantee.
+"""
+import typing
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+
+@dataclass
+class LimitPlan:
+    # (operation to create, name of its innermost limit), in creation order
+    choices: typing.List[typing.Tuple[typing.Any, str]] = field(default_factory=list)
+    # Why the plan looks like this, one line per limit
+    notes: typing.List[str] = field(default_factory=list)
+
+
+def plan_limits(limits, operations) -> LimitPlan:
+    """limits is {name: LimitCount} and operations the operations in file order.
+    Candidates of a limit are in LimitCount.ops."""
+    candidates = set()
+    for limit in limits.values():
+        candidates.update(limit.ops)
+    # Keep the order of the file so the plan is deterministic
+    candidates = [op for op in operations if op in candidates]
+
+    parents = {}
+    for op in candidates:
+        chain = [limit.name for limit in op.limits]
+        for parent, child in zip([None] + chain, chain):
+            if parents.setdefault(child, parent) != parent:
+                return plan_greedy(limits, candidates)
+
+    return plan_nested(limits, candidates, parents)
+
+
+def remaining(limit):
+    return max(0, limit.target - limit.current)
+
+
+def merge(left, right):
+    """Knapsack merge of two lists of the most satisfied limits with exactly b
+    tables. Returns (merged, taken) where taken[b] is the tables of b given to
+    right. Ties give less to right, so the items merged first are served first."""
+    merged = []
+    taken = []
+    for b in range(len(left) + len(right) - 1):
+        best, best_y = None, 0
+        for y in range(max(0, b - len(left) + 1), min(b, len(right) - 1) + 1):
+            value = left[b - y] + right[y]
+            if best is None or value > best:
+                best, best_y = value, y
+        merged.append(best)
+        taken.append(best_y)
+    return merged, taken
+
+
+def plan_nested(limits, candidates, parents) -> LimitPlan:
+    children = defaultdict(list)
+    for name in limits:
+        children[parents.get(name)].append(name)
+    direct_ops = defaultdict(list)
+    for op in candidates:
+        direct_ops[op.limits[-1].name].append(op)
+
+    # best[name][b]: most limits satisfied under name (itself included) with exactly b tables
+    best = {}
+    # Steps of the merge of each limit: (child or None for its own operations, taken)
+    steps = {}
+
+    def solve(name):
+        merged = [0]
+        steps[name] = []
+        for child in children[name]:
+            solve(child)
+            merged, taken = merge(merged, best[child])
+            steps[name].append((child, taken))
+        merged, taken = merge(merged, [0] * (len(direct_ops[name]) + 1))
+        steps[name].append((None, taken))
+        missing = remaining(limits[name])
+        best[name] = [merged[b] + (b == missing) for b in range(min(missing, len(merged) - 1) + 1)]
+
+    plan = LimitPlan()
+    allocated = {}
+
+    def allocate(name, budget):
+        allocated[name] = budget
+        amounts = []
+        for item, taken in reversed(steps[name]):
+            amounts.append((item, taken[budget]))
+            budget -= taken[budget]
+        for item, amount in reversed(amounts):
+            if item is None:
+                for op in direct_ops[name][:amount]:
+                    plan.choices.append((op, name))
+            else:
+                allocate(item, amount)
+
+    for root in children[None]:
+        solve(root)
+        # Most satisfied limits, then most tables
+        allocate(root, max(range(len(best[root])), key=lambda b: (best[root][b], b)))
+
+    for name, limit in limits.items():
+        missing = remaining(limit)
+        if missing == 0:
+            plan.notes.append(f"{name}: {limit.current}/{limit.target} already filled")
+            continue
+        capacity = len(best[name]) - 1
+        note = f"{name}: {limit.current}/{limit.target}, creating {allocated.get(name, 0)}"
+        if allocated.get(name, 0) < missing:
+            if capacity < missing:
+                note += f" (only {capacity} possible with the remaining operations)"
+            else:
+                note += " (more limits are satisfied when other limits get the tables)"
+        plan.notes.append(note)
+    return plan
+
+
+def plan_greedy(limits, candidates) -> LimitPlan:
+    plan = LimitPlan(notes=["Limits are not nested, filling them greedily in file order"])
+    created = defaultdict(int)
+    for op in candidates:
+        if all(created[limit.name] < remaining(limits[limit.name]) for limit in op.limits):
+            for limit in op.limits:
+                created[limit.name] += 1
+            plan.choices.append((op, op.limits[-1].name))
+    for name, limit in limits.items():
+        plan.notes.append(f"{name}: {limit.current}/{limit.target}, creating {created[name]}")
+    return plan
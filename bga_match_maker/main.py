@@ -1,65 +1,133 @@
-from collections import ChainMap, defaultdict
+from collections import defaultdict
 import typing
 import json
+from contextlib import nullcontext
+from types import MappingProxyType
 from dataclasses import dataclass, field
-import logging.handlers
+import logging
 import argparse
-import random
+import time
+
+# Modules that import requests or asyncio (bga_account, bga_account_async,
+# bga_game_list, bga_create_game) are imported where they are used, so that
+# --help and --validate start fast.
+from .bga_options import TABLE_OPTIONS, OptionError, compile_options
+from .table_index import TableIndex, option_fingerprint
+from .limit_planner import plan_limits
+from .run_state import RunState, operations_hash
+from .session_store import SessionStore
+from . import metrics, tracing, transport
+from .cache_to_file import DEFAULT_PATH as DEFAULT_CACHE_PATH, SQLiteBackend, set_backend
+
+# Not __name__: run with `python -m bga_match_maker.main` it is __main__, which is
+# not under the package logger that setup_logging() writes to stderr.
+logger = logging.getLogger("bga_match_maker.main")
+logger.setLevel(logging.INFO)
 
-from .bga_account import BGAAccount
-from .bga_game_list import get_game_list
-from .bga_create_game import create_bga_game
 
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
+_log_handler = None
 
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
-logger.addHandler(ch)
 
-parser = argparse.ArgumentParser(prog="bga-utils")
-parser.add_argument('--users-path', required=True)
-parser.add_argument('--operations-path', required=True)
-parser.add_argument("--validate", default=False, action='store_true')
-parser.add_argument("--dry-run", default=False, action='store_true')
+def setup_logging():
+    """Log to stderr. On the package logger so that every module of the command line tool can log."""
+    global _log_handler
+    if _log_handler is not None:
+        return
+    _log_handler = logging.StreamHandler()
+    _log_handler.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    _log_handler.setFormatter(formatter)
+    logging.getLogger("bga_match_maker").addHandler(_log_handler)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="bga-utils")
+    parser.add_argument('--users-path', required=True)
+    parser.add_argument('--operations-path', required=True)
+    parser.add_argument("--validate", default=False, action='store_true', help="Check users and operations offline, with the cache only")
+    parser.add_argument("--report", default=None, help="With --validate, write the problems found to this json file (- for stdout)")
+    parser.add_argument("--dry-run", default=False, action='store_true')
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH, help="SQLite database used as cache")
+    parser.add_argument("--session-path", default=None, help="Keep logged in sessions in this file between runs")
+    parser.add_argument("--state-path", default=None, help="Skip creators whose operations and tables did not change since the last run")
+    parser.add_argument("--daemon", default=False, action='store_true', help="Keep running and reconcile every creator on a schedule")
+    parser.add_argument("--interval", default=3600, type=int, help="Seconds between two reconciles of a creator in daemon mode")
+    parser.add_argument("--status-path", default=None, help="Daemon mode: write the state of every creator to this json file")
+    parser.add_argument("--base-url", default=None, help="Talk to this server instead of boardgamearena.com (like a fake_bga server)")
+    parser.add_argument("--record", default=None, help="Record every exchange with BGA as fixtures in this directory")
+    parser.add_argument("--replay", default=None, help="Replay the fixtures of this directory instead of talking to BGA")
+    parser.add_argument("--jobs", default=1, type=int, help="Number of creator accounts handled at the same time")
+    parser.add_argument("--metrics-path", default=None, help="Write request and cache metrics to this file in the Prometheus text format")
+    parser.add_argument("--trace", default=None, help="Write the phases of the run to this file as a Chrome trace (chrome://tracing, Perfetto)")
+    parser.add_argument("--profile", default=None, help="Write cProfile stats of the run to this file")
+    return parser
 
 
 @dataclass
 class User:
     name: str
     password: typing.Optional[str] = None
+    # Seconds between two reconciles in daemon mode, None for the default
+    interval: typing.Optional[int] = None
 
     @property
     def has_password(self):
         return self.password is not None
 
 
-@dataclass
+@dataclass(slots=True)
 class Limit:
     name: str
     limit: int
 
 
-@dataclass
+# Options of the operations that have none, read-only like all operation options
+NO_OPTIONS = MappingProxyType({})
+
+
+@dataclass(slots=True)
 class Operation:
     game: str
     toCreate: str
-    limits: typing.List[Limit] = field(default_factory=list)
-    toInvite: typing.Set[str] = field(default_factory=set)
-    options: typing.Dict[str, str] = field(default_factory=dict)
+    # Shared with the other operations of the same subtree, never mutate them
+    limits: typing.Tuple[Limit, ...] = ()
+    toInvite: typing.Tuple[str, ...] = ()
+    # Read-only, equal options are one object shared by all the operations
+    options: typing.Mapping[str, str] = field(default_factory=lambda: NO_OPTIONS)
 
     def __hash__(self):
         return id(self)
 
 
+class OperationContext(typing.NamedTuple):
+    """What a node of the operations tree passes down to its children. A child
+    that does not change a field shares the object of its parent."""
+    toCreate: typing.Optional[str] = None
+    toInvite: typing.Tuple[str, ...] = ()
+    limits: typing.Tuple[Limit, ...] = ()
+    options: typing.Mapping[str, str] = NO_OPTIONS
+
+
 @dataclass
 class Config:
     users_path: str
     operations_path: str
     validate: bool
     dry_run: bool
+    jobs: int = 1
+    session_path: typing.Optional[str] = None
+    cache_path: str = DEFAULT_CACHE_PATH
+    state_path: typing.Optional[str] = None
+    daemon: bool = False
+    interval: int = 3600
+    status_path: typing.Optional[str] = None
+    base_url: typing.Optional[str] = None
+    record: typing.Optional[str] = None
+    replay: typing.Optional[str] = None
+    metrics_path: typing.Optional[str] = None
+    trace: typing.Optional[str] = None
+    profile: typing.Optional[str] = None
+    report: typing.Optional[str] = None
 
     def users_gen(self):
         with open(self.users_path) as f:
@@ -78,74 +146,90 @@ class Config:
                 if isinstance(user, str):
                     yield User(user)
                 else:
-                    yield User(user['username'], user['password'])
+                    yield User(user['username'], user['password'], user.get('interval'))
 
     def users(self):
         return {user.name: user for user in self.users_gen()}
 
     def operations(self):
         errors = []
+        return (list(self.iter_operations(errors)), errors)
 
-        limits = []
-
-        def parse_list(elems, context):
-            for elem in elems:
-                yield from parse_any(elem, context)
-
-        def make_operation(game, context):
-            return Operation(game, **context)
-
-        def parse_dict(elem, parent_context: ChainMap):
-            context = parent_context.new_child()
-
-            toCreate = elem.get("toCreate")
-            if toCreate is not None:
-                context["toCreate"] = toCreate
-
-            toInvite = elem.get("toInvite")
-            if toInvite is not None:
-                if isinstance(toInvite, str):
-                    context["toInvite"] = context.get("toInvite", []) + [toInvite]
-                elif isinstance(toInvite, list):
-                    context["toInvite"] = context.get("toInvite", []) + toInvite
-                else:
-                    errors.append(Exception("toInvite", toInvite))
-
-            options = elem.get("options")
-            if options is not None:
-                context["options"] = context.get("options", {}) | options
-
-            limit_value = elem.get("limit")
-            if limit_value is not None:
-                limit = Limit(f"Limit {len(limits) + 1}", int(limit_value))
-                limits.append(limit)
-                context["limits"] = context.get("limits", []) + [limit]
-
-            game = elem.get("game")
-            if game is not None:
-                yield make_operation(game, context)
-
-            yield from parse_any(elem.get("children"), context)
-            yield from parse_any(elem.get("c"), context)
-
-        def parse_any(elem, context: ChainMap):
+    def read_operations(self):
+        """The json of the operations file."""
+        with open(self.operations_path) as f:
+            return json.load(f)
+
+    def iter_operations(self, errors, root=None):
+        """Yield the operations of the operations file (or of root, its json) in file
+        order, appending problems to errors.
+
+        The tree is walked with a stack instead of recursion and the inherited
+        values are shared instead of copied at each level, so deep and large
+        trees take time and memory linear in the size of the file.
+        """
+        if root is None:
+            root = self.read_operations()
+
+        limit_count = 0
+        # Equal option dicts are the same object, whatever the node that made them
+        options_pool = {}
+        stack = [(root, OperationContext())]
+        while stack:
+            elem, context = stack.pop()
             try:
                 if elem is None:
                     pass
                 elif isinstance(elem, dict):
-                    yield from parse_dict(elem, context)
+                    toCreate = elem.get("toCreate")
+                    if toCreate is not None:
+                        context = context._replace(toCreate=toCreate)
+
+                    toInvite = elem.get("toInvite")
+                    if toInvite is not None:
+                        if isinstance(toInvite, str):
+                            context = context._replace(toInvite=context.toInvite + (toInvite,))
+                        elif isinstance(toInvite, list):
+                            context = context._replace(toInvite=context.toInvite + tuple(toInvite))
+                        else:
+                            errors.append(Exception("toInvite", toInvite))
+
+                    options = elem.get("options")
+                    if options is not None:
+                        options = MappingProxyType(context.options | options)
+                        try:
+                            options = options_pool.setdefault(tuple(options.items()), options)
+                        except TypeError:
+                            pass
+                        context = context._replace(options=options)
+
+                    limit_value = elem.get("limit")
+                    if limit_value is not None:
+                        limit = Limit(f"Limit {limit_count + 1}", int(limit_value))
+                        limit_count += 1
+                        context = context._replace(limits=context.limits + (limit,))
+
+                    game = elem.get("game")
+                    if game is not None:
+                        yield self.make_operation(game, context)
+
+                    # Last pushed is walked first: children, then c
+                    stack.append((elem.get("c"), context))
+                    stack.append((elem.get("children"), context))
                 elif isinstance(elem, list):
-                    yield from parse_list(elem, context)
+                    stack.extend((child, context) for child in reversed(elem))
                 elif isinstance(elem, str):
-                    yield make_operation(elem, context)
+                    yield self.make_operation(elem, context)
                 else:
                     errors.append(Exception(elem))
             except Exception as e:
                 errors.append(e)
 
-        with open(self.operations_path) as f:
-            ops = list(parse_any(json.load(f), ChainMap()))
-            return (ops, errors)
+    @staticmethod
+    def make_operation(game, context: OperationContext):
+        if context.toCreate is None:
+            raise Exception("No toCreate for game", game)
+        return Operation(game, context.toCreate, context.limits, context.toInvite, context.options)
 
 
 @dataclass
@@ -155,185 +239,305 @@ class LimitCount:
     ops: typing.Set[Operation] = field(default_factory=set)
 
 
-def apply_operations(creater: User, operations: typing.List[Operation], dry_run):
-    account = BGAAccount()
+@dataclass
+class CreatorReport:
+    creator: str
+    found: int = 0
+    created: typing.List[int] = field(default_factory=list)
+    dry_run: int = 0
+    errors: typing.List[str] = field(default_factory=list)
+    skipped: bool = False
+
+    def summary(self):
+        if self.skipped:
+            return f"{self.creator}: unchanged, skipped"
+        return (f"{self.creator}: found={self.found} created={len(self.created)} "
+                f"dry_run={self.dry_run} errors={len(self.errors)}")
+
+
+class CreatorLogAdapter(logging.LoggerAdapter):
+    """Prefix messages with the creator so logs of parallel jobs can be told apart."""
+
+    def process(self, msg, kwargs):
+        return f"[{self.extra['creator']}] {msg}", kwargs
+
+
+def open_account(creater: User, session_store: typing.Optional[SessionStore]):
+    """Return a logged in (account, player id), reusing a stored session when it is still valid."""
+    with tracing.span("login", creator=creater.name):
+        return _open_account(creater, session_store)
+
+
+def _open_account(creater: User, session_store: typing.Optional[SessionStore]):
+    from .bga_account import BGAAccount
+
+    if session_store is not None:
+        state = session_store.load(creater.name)
+        if state is not None:
+            account = BGAAccount(state)
+            if account.verify_privileged():
+                logger.debug(f"Reusing stored session of {creater.name}")
+                return account, state["player_id"]
+            logger.info(f"Stored session of {creater.name} expired")
+            account.close_connection()
+            session_store.forget(creater.name)
+
     if not creater.has_password:
         raise Exception("no password here...")
 
-    account.login(creater.name, creater.password)
+    account = BGAAccount()
+    if not account.login(creater.name, creater.password):
+        account.close_connection()
+        raise Exception(f"Could not login as {creater.name}")
 
     player_id = account.get_player_id(creater.name)
+    if session_store is not None:
+        session_store.save(creater.name, account.session_state() | {"player_id": player_id})
+    return account, player_id
 
-    tables = account.get_tables(player_id) or {}
-    games = get_game_list()
 
-    limits = defaultdict(LimitCount)
+def close_account(account, creater: User, player_id, session_store: typing.Optional[SessionStore]):
+    if session_store is None:
+        account.logout()
+    else:
+        # Logging out would invalidate the stored session, save the latest cookies instead.
+        session_store.save(creater.name, account.session_state() | {"player_id": player_id})
+    account.close_connection()
 
-    for op in operations:
-        try:
-            found_table = None
 
-            game_id = games[op.game]["id"]
-            op_names = set(op.toInvite) | {op.toCreate}
+def apply_operations(creater: User, operations: typing.List[Operation], dry_run, session_store=None, run_state=None):
+    account, player_id = open_account(creater, session_store)
+    try:
+        return reconcile(account, player_id, creater, operations, dry_run, run_state)
+    finally:
+        close_account(account, creater, player_id, session_store)
+
+
+def reconcile(account, player_id, creater: User, operations: typing.List[Operation], dry_run, run_state=None):
+    """Find or create the tables of the operations of creater with a logged in account."""
+    import asyncio
+    from .bga_account_async import AsyncBGAAccount
+    from .bga_create_game import create_bga_game
+    from .bga_game_list import get_game_catalog
+
+    log = CreatorLogAdapter(logger, {"creator": creater.name})
+    report = CreatorReport(creater.name)
+
+    with tracing.span("table fetch", creator=creater.name):
+        tables = account.get_tables(player_id) or {}
+    ops_hash = operations_hash(operations)
+    if run_state is not None and run_state.is_unchanged(creater.name, ops_hash, tables):
+        log.info("Operations unchanged since the last run and their tables are still there. Skipping.")
+        report.skipped = True
+        return report
+
+    # Resolve every invitee once and up front, create_bga_game then hits the cache.
+    # A failed lookup only fails the operations of that invitee, when
+    # create_bga_game looks the player up again.
+    invitees = {name for op in operations for name in op.toInvite}
+    with tracing.span("invitees", creator=creater.name, count=len(invitees)):
+        asyncio.run(AsyncBGAAccount(account).get_player_ids(invitees))
+
+    catalog = get_game_catalog()
+    # Tables found or created for the operations
+    tracked_tables = []
+
+    def create(op, reason):
+        if dry_run:
+            log.info(f"Could create game (DRY RUN)({reason}): ${op=}")
+            report.dry_run += 1
+            return
+        log.info(f"Creating game. ({reason}) ${op=}")
+        start = time.monotonic()
+        with tracing.span("create_bga_game", creator=creater.name, game=op.game, reason=reason):
+            table_id = create_bga_game(account, op.game, op.toInvite, op.options)
+        metrics.registry.observe("bga_create_table_seconds", time.monotonic() - start, game=op.game)
+        if table_id is None:
+            report.errors.append(f"Could not create {op.game} for {op}")
+        else:
+            report.created.append(table_id)
+            tracked_tables.append(table_id)
 
-            for table in tables.values():
-                # The table has the right game
-                if game_id != int(table['game_id']):
-                    continue
-
-                # The right person created the table
-                if player_id != table["table_creator"]:
-                    continue
+    limits = defaultdict(LimitCount)
 
-                table_names = {player["fullname"] for player in table["players"].values()}
-                # If players are missing from the expected name list, then abort
-                missing = op_names - table_names
-                if len(missing) > 0:
-                    logger.debug(f"Skipping by missing players {missing=}")
-                    continue
+    with tracing.span("matching", creator=creater.name, operations=len(operations)):
+        table_index = TableIndex(tables, player_id)
+        for op in operations:
+            try:
+                game = catalog.lookup(op.game)
+                op_names = set(op.toInvite) | {op.toCreate}
 
                 # Check that parameters for the game are correct
+                players = None
+                required_options = frozenset()
                 if len(op.options) > 0:
+                    # Every option, including the ones only set when creating a table, must be
+                    # valid before a table is created for nothing.
+                    try:
+                        compile_options(game["codename"], op.options, account.get_game_info)
+                    except OptionError as e:
+                        raise Exception(str(e))
+
                     # Check the player count if available
                     players = op.options.get("players", None)
-                    if players is not None:
-                        table_players = table["max_player"]
-                        operation_players = str(players)
-                        if operation_players != table_players:
-                            logger.debug(f"Skipping by playing count{table_players=} {operation_players=}")
-                            continue
 
                     # Check options that are handle by changeoption.html
                     # Remove options that are set via other paths than changeoption.html
-                    options_copy = dict(op.options)
-                    options_copy.pop("mode", None)
-                    options_copy.pop("minrep", None)
-                    options_copy.pop("presentation", None)
-                    options_copy.pop("levels", None)
-                    options_copy.pop("players", None)
-                    options_copy.pop("restrictgroup", None)
-                    options_copy.pop("lang", None)
-
-                    optionsToCheck = account.parse_options(options_copy, table["id"], games[op.game]["codename"])
-
-                    allOptionOK = False
-                    for optionToCheck in optionsToCheck:
-                        if optionToCheck["path"] != "/table/table/changeoption.html":
-                            # Only handle changeoption for now
-                            continue
-                        optionIdToCheck = optionToCheck["params"]["id"]
-                        optionValueToCheck = optionToCheck["params"]["value"]
-                        if table["options"].get(str(optionIdToCheck)) != str(optionValueToCheck):
-                            break
-                    else:
-                        allOptionOK = True
+                    options_copy = {option: value for option, value in op.options.items() if option not in TABLE_OPTIONS}
+                    url_data = account.parse_options(options_copy, None, game["codename"])
+                    if isinstance(url_data, str):  # In this case it's an error
+                        raise Exception(url_data)
+                    required_options = option_fingerprint(url_data)
 
-                    if not allOptionOK:
-                        continue
+                found_table = table_index.find(game["id"], op_names, players, required_options)
 
-                found_table = table
-                break
-
-            for limit in op.limits:
-                limits[limit.name].target = limit.limit
+                for limit in op.limits:
+                    limits[limit.name].target = limit.limit
 
-            if found_table is not None:
-                logger.info(f"Found table. Skipping creation. {op=}")
+                if found_table is not None:
+                    log.info(f"Found table. Skipping creation. {op=}")
+                    report.found += 1
+                    tracked_tables.append(found_table["id"])
 
-                for limit in op.limits:
-                    limits[limit.name].current += 1
-                continue
-            else:
-                if len(op.limits) > 0:
                     for limit in op.limits:
-                        limits[limit.name].ops.add(op)
+                        limits[limit.name].current += 1
+                    continue
                 else:
-                    if dry_run:
-                        logger.info(f"Could create game (DRY RUN)(NO LIMITS): ${op=}")
+                    if len(op.limits) > 0:
+                        for limit in op.limits:
+                            limits[limit.name].ops.add(op)
                     else:
-                        logger.info(f"Creating game. (NO LIMITS) ${op=}")
-                        create_bga_game(account, op.game, op.toInvite, op.options)
+                        create(op, "NO LIMITS")
 
-        except Exception as e:
-            logger.exception(e)
+            except Exception as e:
+                log.exception(e)
+                report.errors.append(str(e))
 
-    logger.debug(f"limits {limits}")
-    to_remove_by_limit: typing.Set[Operation] = set()
-    for limit in limits.values():
-        if limit.current >= limit.target:
-            to_remove_by_limit.update(limit.ops)
+    log.debug(f"limits {limits}")
+    with tracing.span("limit planning", creator=creater.name):
+        plan = plan_limits(limits, operations)
+    for note in plan.notes:
+        log.info(f"Limit plan: {note}")
+    for choice, name in plan.choices:
+        create(choice, f"LIMITS={name}")
+        for choice_limit in choice.limits:
+            limits[choice_limit.name].current += 1
 
-    for name, limit in sorted(limits.items(), key=lambda name_item: name_item[1].target):
-        available_ops = limit.ops - to_remove_by_limit
+    if run_state is not None and not dry_run:
+        complete = len(report.errors) == 0 and all(limit.current >= limit.target for limit in limits.values())
+        run_state.record(creater.name, ops_hash, tracked_tables, complete)
 
-        missing = limit.target - limit.current
+    return report
 
-        if missing <= 0 or len(available_ops) == 0:
-            continue
 
-        choices = list(available_ops)
+def run_creator(user: User, ops: typing.List[Operation], dry_run, session_store, run_state):
+    """apply_operations that never raises, so one account failing does not stop the others."""
+    try:
+        with tracing.span("creator", creator=user.name):
+            return apply_operations(user, ops, dry_run, session_store, run_state)
+    except Exception as e:
+        logger.exception(e)
+        return CreatorReport(user.name, errors=[str(e)])
 
-        random.shuffle(choices)
-        logger.info(f"Filling limit {name}: {missing=} available_choice={len(choices)}")
-        for choice in choices:
-            if choice in to_remove_by_limit:
-                continue
 
-            if dry_run:
-                logger.info(f"Could create game (DRY RUN)(limit={name}): ${choice=}")
-            else:
-                logger.info(f"Creating game. (LIMITS={name}) ${choice=}")
-                create_bga_game(account, choice.game, choice.toInvite, choice.options)
+def check_operation(op: Operation, users, catalog):
+    """Errors of an operation that can be seen without BGA. The game is not checked when catalog is None."""
+    errors = []
+    if op.toCreate in op.toInvite:
+        errors.append(Exception("Cannot invite to own game", op))
 
-            for choice_limit in choice.limits:
-                name = choice_limit.name
-                limit = limits[name]
-                limit.current += 1
-                if limit.current >= limit.target:
-                    to_remove_by_limit.update(limit.ops)
+    asUser = users.get(op.toCreate)
+    if asUser is None or not asUser.has_password:
+        errors.append(Exception("Missing password to create game", op))
 
-    account.logout()
-    account.close_connection()
+    if catalog is not None and catalog.lookup(op.game) is None:
+        errors.append(Exception("Cannot find game", op))
+    return errors
 
 
-def main():
-    config = Config(**vars(parser.parse_args()))
+def load_operations(config: Config):
+    """Read and check users and operations. Returns (users, operations per creator, errors)."""
+    from .bga_game_list import get_game_catalog
 
-    users = config.users()
-    (operations, errors) = config.operations()
-    op_per_creater = defaultdict(list)
+    with tracing.span("game list load"):
+        catalog = get_game_catalog()
 
-    game_list = get_game_list()
+    op_per_creater = defaultdict(list)
+    errors = []
+    with tracing.span("config parse"):
+        users = config.users()
+        # Operations are checked and grouped as the file is walked
+        for op in config.iter_operations(errors):
+            errors.extend(check_operation(op, users, catalog))
+            op_per_creater[op.toCreate].append(op)
 
-    for op in operations:
-        creater = op.toCreate
+    return users, op_per_creater, errors
 
-        if creater in op.toInvite:
-            errors.append(Exception("Cannot invite to own game", op))
 
-        asUser = users.get(creater)
-        if asUser is None or not asUser.has_password:
-            errors.append(Exception("Missing password to create game", op))
+def main():
+    config = Config(**vars(build_parser().parse_args()))
+    setup_logging()
+    if config.trace:
+        tracing.start()
+    profiler = tracing.Profiler() if config.profile else None
+    try:
+        with profiler or nullcontext():
+            return run(config)
+    finally:
+        if config.trace:
+            tracing.write(config.trace)
+        if profiler is not None:
+            profiler.dump(config.profile)
+
+
+def run(config: Config):
+    """Returns the exit code."""
+    set_backend(SQLiteBackend(config.cache_path))
+    transport.configure(config.base_url, config.record, config.replay, jobs=config.jobs)
 
-        if game_list.get(op.game) is None:
-            errors.append(Exception("Cannot find game", op))
+    if config.validate:
+        # Before anything that could send a request
+        from . import validate
+        return 0 if validate.report(validate.validate(config), config.report) else 1
 
-        op_per_creater[creater].append(op)
+    users, op_per_creater, errors = load_operations(config)
 
     if len(errors) > 0:
         print(errors)
-        return
+        return 1
 
-    if config.validate:
-        print("config validated")
-        print(operations)
+    session_store = SessionStore(config.session_path) if config.session_path else None
+    run_state = RunState(config.state_path) if config.state_path else None
+
+    if config.daemon:
+        from .daemon import Daemon
+        Daemon(config, session_store, run_state).run()
         return
 
-    for username, ops in op_per_creater.items():
-        user = users[username]
-        apply_operations(user, ops, config.dry_run)
+    def run_item(item):
+        return run_creator(users[item[0]], item[1], config.dry_run, session_store, run_state)
+
+    if config.jobs <= 1:
+        # In the main thread, where --profile sees it
+        reports = [run_item(item) for item in op_per_creater.items()]
+    else:
+        # Every job shares the process wide rate limiter of BGAAccount, so more
+        # jobs do not mean more requests per second to BGA.
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=config.jobs) as executor:
+            reports = list(executor.map(run_item, op_per_creater.items()))
+
+    logger.info("Run summary:")
+    for report in reports:
+        logger.info(report.summary())
+        for error in report.errors:
+            logger.info(f"  {error}")
+    for line in metrics.registry.summary():
+        logger.info(line)
+    if config.metrics_path:
+        metrics.registry.write_prometheus(config.metrics_path)
 
 
 if __name__ == "__main__":
     # BGAAccount().get_game_info("wingspan")
-    main()
+    raise SystemExit(main())
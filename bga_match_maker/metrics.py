@@ -0,0 +1,161 @@
+"""Counters and latency histograms of what a run does.
+
+transport.send records every request by endpoint path (numbers in paths are
+replaced by {id}), the cache records its hits and misses and the rate limiter
+the time spent waiting. The registry can be written in the Prometheus text
+format (for the textfile collector of node_exporter) or summarized in the logs
+at the end of a run.
+"""
+import bisect
+import os
+import re
+import threading
+import urllib.parse
+from collections import defaultdict
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+HELP = {
+    "bga_requests_total": ("counter", "Requests sent to BGA by endpoint and status (error when no response)"),
+    "bga_request_seconds": ("histogram", "Time to get a response from BGA"),
+    "bga_response_bytes_total": ("counter", "Size of the response bodies from BGA"),
+    "bga_rate_limit_sleep_seconds_total": ("counter", "Time spent waiting for the rate limiter by endpoint class"),
+    "bga_cache_requests_total": ("counter", "Cache lookups by namespace and result (memory, hit, miss, stale, revalidated)"),
+    "bga_create_table_seconds": ("histogram", "Time to create and set up a table by game"),
+}
+
+
+def endpoint_path(url):
+    """Path of url with the numbers replaced, so that tables and players share one series."""
+    return re.sub(r"\d+", "{id}", urllib.parse.urlsplit(url).path) or "/"
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels) + "}"
+
+
+class Registry:
+    """Thread safe store of counters and histograms, each keyed by name and labels."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def to_prometheus(self):
+        """The registry in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            names = sorted({name for name, _ in self.counters} | {name for name, _ in self.histograms})
+            for name in names:
+                metric_type, description = HELP.get(name, ("untyped", name))
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{name}{format_labels(labels)} {value:g}")
+                for (histogram_name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum:g}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the registry to path, atomically so a collector never reads half a file."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def summary(self):
+        """Lines of a table of the requests by endpoint, then of the cache and of the rate limiter."""
+        with self.lock:
+            requests = defaultdict(lambda: {"count": 0, "errors": 0, "seconds": 0.0, "max": 0.0, "bytes": 0})
+            for (name, labels), histogram in self.histograms.items():
+                if name == "bga_request_seconds":
+                    row = requests[dict(labels)["endpoint"]]
+                    row["count"] += histogram.count
+                    row["seconds"] += histogram.sum
+                    row["max"] = max(row["max"], histogram.max)
+            caches = defaultdict(lambda: defaultdict(int))
+            sleeps = {}
+            for (name, labels), value in self.counters.items():
+                labels = dict(labels)
+                if name == "bga_requests_total":
+                    if labels["status"] == "error" or int(labels["status"]) >= 400:
+                        requests[labels["endpoint"]]["errors"] += int(value)
+                elif name == "bga_response_bytes_total":
+                    requests[labels["endpoint"]]["bytes"] += int(value)
+                elif name == "bga_cache_requests_total":
+                    caches[labels["namespace"]][labels["result"]] += int(value)
+                elif name == "bga_rate_limit_sleep_seconds_total":
+                    sleeps[labels["endpoint_class"]] = value
+
+        lines = []
+        if requests:
+            lines.append(f"{'endpoint':<50} {'requests':>8} {'errors':>6} {'total s':>8} {'mean s':>7} {'max s':>7} {'kB':>8}")
+            for endpoint, row in sorted(requests.items(), key=lambda item: -item[1]["seconds"]):
+                mean = row["seconds"] / row["count"] if row["count"] else 0
+                lines.append(f"{endpoint:<50} {row['count']:>8} {row['errors']:>6} {row['seconds']:>8.2f} "
+                             f"{mean:>7.3f} {row['max']:>7.3f} {row['bytes'] / 1024:>8.1f}")
+        for namespace, results in sorted(caches.items()):
+            lookups = sum(results.values())
+            hits = results["memory"] + results["hit"] + results["revalidated"]
+            line = (f"cache {namespace}: {lookups} lookups, {hits / lookups:.0%} hits "
+                    f"(memory={results['memory']} hit={results['hit']} miss={results['miss']} stale={results['stale']}")
+            # Only the http cache revalidates (a 304 from BGA instead of the whole page)
+            if results["revalidated"]:
+                line += f" revalidated={results['revalidated']}"
+            lines.append(line + ")")
+        for endpoint_class, seconds in sorted(sleeps.items()):
+            lines.append(f"rate limiter {endpoint_class}: waited {seconds:.2f}s")
+        return lines
+
+
+# Shared by the whole process
+registry = Registry()
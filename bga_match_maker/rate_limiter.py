@@ -0,0 +1,133 @@
+"""Token bucket rate limiting of the requests sent to BGA.
+
+Requests are sorted in endpoint classes (login, table mutations, lookups), each
+with its own bucket. The buckets are shared by every BGAAccount of the process,
+so several accounts do not add up their budgets. A request only sleeps when its
+bucket is out of credit. When BGA answers with errors or slowly, the refill rate
+of the bucket is halved, then it recovers a little with each good response.
+"""
+import logging
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+LOGIN = "login"
+MUTATION = "mutation"
+LOOKUP = "lookup"
+
+# Paths that change something on BGA. Everything else under /account is LOGIN
+# and the rest is LOOKUP.
+MUTATION_PREFIXES = (
+    "/table/table/",
+    "/community/community/",
+    "/group/group/removeAllFromGameSession",
+)
+# Read-only endpoints that live under a mutation prefix.
+LOOKUP_PATHS = ("/table/table/tableinfos.html",)
+
+# A response slower than this (in seconds) is a sign that BGA is under load.
+SLOW_RESPONSE = 5.0
+# The rate never goes below this fraction of the configured rate.
+MIN_RATE_FACTOR = 0.1
+# Fraction of the configured rate given back after each good response.
+RECOVERY_FACTOR = 0.05
+
+
+@dataclass
+class Budget:
+    rate: float  # Requests per second in the long run
+    burst: int  # Requests that can be sent back to back
+
+
+DEFAULT_BUDGETS = {
+    LOGIN: Budget(rate=0.5, burst=2),
+    MUTATION: Budget(rate=1, burst=5),
+    LOOKUP: Budget(rate=2, burst=10),
+}
+
+
+def endpoint_class(url):
+    """Return the endpoint class (LOGIN, MUTATION or LOOKUP) of an url."""
+    path = urllib.parse.urlsplit(url).path
+    if path.startswith("/account"):
+        return LOGIN
+    if path.startswith(MUTATION_PREFIXES) and path not in LOOKUP_PATHS:
+        return MUTATION
+    return LOOKUP
+
+
+class TokenBucket:
+    """Thread safe token bucket whose rate adapts to how BGA responds."""
+
+    def __init__(self, budget: Budget):
+        self.budget = budget
+        self.rate = budget.rate
+        self.tokens = float(budget.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.budget.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Take a token, sleeping until it is available. Return the time slept."""
+        with self.lock:
+            self._refill()
+            # Reserve the token right away, a negative count is a queue of waiters.
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def penalize(self):
+        """Slow down: halve the rate and drop the burst credit."""
+        with self.lock:
+            self._refill()
+            self.rate = max(self.budget.rate * MIN_RATE_FACTOR, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def reward(self):
+        """Speed back up toward the configured rate."""
+        with self.lock:
+            if self.rate < self.budget.rate:
+                self._refill()
+                self.rate = min(self.budget.rate, self.rate + self.budget.rate * RECOVERY_FACTOR)
+
+
+class RateLimiter:
+    """One bucket per endpoint class."""
+
+    def __init__(self, budgets=None):
+        budgets = budgets or DEFAULT_BUDGETS
+        self.buckets = {name: TokenBucket(budget) for name, budget in budgets.items()}
+
+    def configure(self, name, rate=None, burst=None):
+        """Change the budget of an endpoint class."""
+        budget = self.buckets[name].budget
+        self.buckets[name] = TokenBucket(Budget(
+            rate=budget.rate if rate is None else rate,
+            burst=budget.burst if burst is None else burst,
+        ))
+
+    def acquire(self, url):
+        """Wait until a request to url is allowed. Return the time slept."""
+        return self.buckets[endpoint_class(url)].acquire()
+
+    def record(self, url, ok, elapsed):
+        """Feed back how a request went so the bucket can adapt."""
+        bucket = self.buckets[endpoint_class(url)]
+        if not ok or elapsed > SLOW_RESPONSE:
+            bucket.penalize()
+            logger.debug(f"Slowing down {endpoint_class(url)} requests to {bucket.rate:.2f}/s")
+        else:
+            bucket.reward()
+
+
+# Shared by every BGAAccount of the process.
+shared_limiter = RateLimiter()
@@ -0,0 +1,55 @@
+"""Remember what the last run did for every creator.
+
+For every creator the journal keeps a hash of its operations, the tables that
+were found or created for them and whether everything was satisfied. When the
+operations did not change and all those tables are still running, the next run
+can skip the creator after fetching its table list once.
+"""
+import hashlib
+import json
+import time
+
+from .session_store import JsonStore
+
+DEFAULT_PATH = "bga_run_state.json"
+# Do a full reconcile of a creator at least this often, even if nothing changed
+MAX_SKIP_AGE = 24 * 3600
+
+
+def operations_hash(operations):
+    """Hash of what operations ask for. Limit names are numbered across the whole
+    operations file, so limits are numbered by first use in operations instead:
+    a limit added for another creator does not change the hash."""
+    limit_numbers = {}
+    content = []
+    for op in operations:
+        limits = [(limit_numbers.setdefault(limit.name, len(limit_numbers)), limit.limit) for limit in op.limits]
+        content.append([op.game, op.toCreate, limits, list(op.toInvite), dict(op.options)])
+    content = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class RunState(JsonStore):
+    """{creator: {"operations_hash", "tables", "complete", "verified_at"}}"""
+
+    def __init__(self, path=DEFAULT_PATH):
+        super().__init__(path)
+
+    def is_unchanged(self, creator, ops_hash, tables):
+        """True when the last run of creator had the same operations, satisfied all of
+        them, was fully verified recently and all its tables are still in tables."""
+        state = self.load(creator)
+        if state is None or not state["complete"] or state["operations_hash"] != ops_hash:
+            return False
+        if time.time() - state["verified_at"] > MAX_SKIP_AGE:
+            return False
+        running = {str(table["id"]) for table in tables.values()}
+        return set(state["tables"]) <= running
+
+    def record(self, creator, ops_hash, table_ids, complete):
+        self.save(creator, {
+            "operations_hash": ops_hash,
+            "tables": sorted({str(table_id) for table_id in table_ids}),
+            "complete": complete,
+            "verified_at": time.time(),
+        })
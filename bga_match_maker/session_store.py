@@ -0,0 +1,92 @@
+"""Keep authenticated BGA sessions on disk between runs.
+
+For every username the store keeps the session cookies, the request token and
+the player id of the account. A run can then check the session with a single
+request instead of scraping the request token, logging in and looking up the
+player id again.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = "bga_sessions.json"
+
+
+def cookies_to_list(cookie_jar):
+    return [
+        {
+            "name": cookie.name,
+            "value": cookie.value,
+            "domain": cookie.domain,
+            "path": cookie.path,
+            "expires": cookie.expires,
+            "secure": cookie.secure,
+        }
+        for cookie in cookie_jar
+    ]
+
+
+def cookies_from_list(cookie_jar, cookies):
+    for cookie in cookies:
+        cookie_jar.set(
+            cookie["name"],
+            cookie["value"],
+            domain=cookie["domain"],
+            path=cookie["path"],
+            expires=cookie["expires"],
+            secure=cookie["secure"],
+        )
+
+
+class JsonStore:
+    """JSON file of {key: dict}, private to the user. Safe to share between threads."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            logger.warning(f"Ignoring unreadable store {self.path}")
+            return {}
+
+    def _write(self, states):
+        # The file can hold login cookies: keep it private and never half written.
+        tmp_path = self.path + ".tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(states, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self, key):
+        """Return the saved state of key or None."""
+        with self.lock:
+            return self._read().get(key)
+
+    def save(self, key, state):
+        with self.lock:
+            states = self._read()
+            states[key] = dict(state, saved_at=time.time())
+            self._write(states)
+
+    def forget(self, key):
+        with self.lock:
+            states = self._read()
+            if states.pop(key, None) is not None:
+                self._write(states)
+
+
+class SessionStore(JsonStore):
+    """{username: session state}"""
+
+    def __init__(self, path=DEFAULT_PATH):
+        super().__init__(path)
@@ -0,0 +1,65 @@
+"""Index the tables of a creator to find the table that satisfies an operation.
+
+Tables are indexed once per run by game and by set of players, with their
+changeoption.html options as a set of (id, value) pairs. Finding the table of
+an operation is then a lookup plus a few set comparisons instead of a scan of
+every table.
+"""
+import typing
+from collections import defaultdict
+from dataclasses import dataclass
+
+from .bga_options import CHANGE_OPTION_PATH
+
+
+@dataclass
+class IndexedTable:
+    table: dict
+    player_names: typing.FrozenSet[str]
+    max_player: str
+    options: typing.FrozenSet[typing.Tuple[str, str]]
+
+
+def option_fingerprint(url_data):
+    """(id, value) pairs that changeoption.html steps of parse_options set. Other
+    paths are not reported by tableinfos, so they cannot be compared."""
+    return frozenset(
+        (str(url_datum["params"]["id"]), str(url_datum["params"]["value"]))
+        for url_datum in url_data
+        if url_datum["path"] == CHANGE_OPTION_PATH
+    )
+
+
+class TableIndex:
+    def __init__(self, tables, creator_id):
+        self.by_game = defaultdict(list)
+        self.by_players = defaultdict(list)
+        for table in tables.values():
+            # Only tables created by the right person
+            if creator_id != table["table_creator"]:
+                continue
+            indexed = IndexedTable(
+                table,
+                frozenset(player["fullname"] for player in table["players"].values()),
+                table["max_player"],
+                frozenset((str(option), str(value)) for option, value in table.get("options", {}).items()),
+            )
+            game_id = int(table["game_id"])
+            self.by_game[game_id].append(indexed)
+            self.by_players[(game_id, indexed.player_names)].append(indexed)
+
+    def find(self, game_id, player_names, players=None, options=frozenset()):
+        """Return a table of game_id with at least player_names at it, players as
+        maximum number of players (if not None) and options set, or None."""
+        player_names = frozenset(player_names)
+        # A table with exactly these players is the most likely match
+        candidates = self.by_players.get((game_id, player_names), [])
+        for indexed in candidates + self.by_game.get(game_id, []):
+            if not player_names <= indexed.player_names:
+                continue
+            if players is not None and str(players) != indexed.max_player:
+                continue
+            if not options <= indexed.options:
+                continue
+            return indexed.table
+        return None
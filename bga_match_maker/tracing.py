@@ -0,0 +1,101 @@
+"""Spans of the phases of a run, written as a Chrome trace.
+
+    with tracing.span("login", creator=name):
+        ...
+
+Spans cost nearly nothing until start() is called (--trace). The trace file can
+be opened in chrome://tracing or https://ui.perfetto.dev: every thread (jobs,
+requests sent by AsyncBGAAccount) gets its own track.
+
+Profiler collects cProfile stats for --profile.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Tracer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_ns = time.perf_counter_ns()
+        self.events = []
+        self.threads = {}
+
+    def add(self, name, category, start_ns, end_ns, args):
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start_ns - self.start_ns) / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+        }
+        if args:
+            event["args"] = {key: str(value) for key, value in args.items()}
+        with self.lock:
+            self.events.append(event)
+            self.threads.setdefault(thread.ident, thread.name)
+
+    def to_json(self):
+        with self.lock:
+            metadata = [
+                {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                for tid, name in self.threads.items()
+            ]
+            return {"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}
+
+
+_tracer = None
+
+
+def start():
+    """Record spans from now on."""
+    global _tracer
+    _tracer = Tracer()
+
+
+def write(path):
+    """Write the spans recorded since start() to path."""
+    if _tracer is None:
+        return
+    with open(path, "w") as f:
+        json.dump(_tracer.to_json(), f)
+
+
+@contextmanager
+def span(name, category="run", **args):
+    """Time the block as a span. args are shown with the span in the trace viewer."""
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    start_ns = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        tracer.add(name, category, start_ns, time.perf_counter_ns(), args)
+
+
+class Profiler:
+    """cProfile of the main thread. Before Python 3.12, cProfile does not see
+    other threads, so jobs are only profiled with --jobs 1 (run in the main thread)."""
+
+    def __init__(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+
+    def __enter__(self):
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.disable()
+
+    def dump(self, path):
+        """Write the stats to path, for pstats or a viewer like snakeviz."""
+        import pstats
+        pstats.Stats(self.profile).dump_stats(path)
@@ -0,0 +1,149 @@
+"""How BGAAccount and the game list reach BGA.
+
+make_session() builds every requests.Session that talks to BGA. By default it
+talks to boardgamearena.com, but configure() can:
+- point it at another base url, like the local stand-in of fake_bga,
+- record every exchange to a directory of fixtures,
+- replay recorded fixtures without any network (see fixtures.py).
+
+Requests go through send(), which waits for the rate limiter and records the
+metrics and the trace span of every request.
+
+Every session mounts one shared adapter, so its pool of keep-alive connections
+is used by all the accounts of a run and by the game list: the TCP and TLS
+handshakes are only paid once per connection, not once per session. Cookies
+stay in each session, connections carry none. Close sessions with
+close_session() to keep the shared connections open. Responses are compressed
+(requests asks for gzip and deflate, and for br when brotli is installed).
+
+requests is only imported once a session is made, so commands that never talk
+to BGA (like --validate) start faster.
+"""
+import threading
+import time
+
+from . import metrics, tracing
+from .rate_limiter import endpoint_class, shared_limiter
+
+DEFAULT_BASE_URL = "https://boardgamearena.com"
+# Parameters that change on every request, left out of fixture and cache keys
+VOLATILE_PARAMS = {"dojo.preventCache"}
+
+# Connections kept open to BGA, at least
+DEFAULT_POOL_SIZE = 10
+# Requests one job can have in flight (AsyncBGAAccount.DEFAULT_CONCURRENCY)
+CONNECTIONS_PER_JOB = 4
+
+_base_url = DEFAULT_BASE_URL
+_record_dir = None
+_replay_dir = None
+_pool_size = DEFAULT_POOL_SIZE
+
+_lock = threading.Lock()
+_adapter = None
+_shared_session = None
+
+
+def configure(base_url=None, record_dir=None, replay_dir=None, jobs=1):
+    """Change where the sessions made from now on send their requests. jobs
+    (accounts handled at the same time) sets how many connections are kept open."""
+    global _base_url, _record_dir, _replay_dir, _pool_size, _adapter, _shared_session
+    if record_dir and replay_dir:
+        raise Exception("Cannot record and replay at the same time")
+    with _lock:
+        _base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        _record_dir = record_dir
+        _replay_dir = replay_dir
+        _pool_size = max(DEFAULT_POOL_SIZE, jobs * CONNECTIONS_PER_JOB)
+        # Sessions made from now on get an adapter for the new settings
+        _adapter = None
+        _shared_session = None
+
+
+def base_url():
+    return _base_url
+
+
+def _get_adapter():
+    """The adapter shared by every session, made on first use. Call with _lock held."""
+    global _adapter
+    if _adapter is None:
+        pool = {"pool_connections": 1, "pool_maxsize": _pool_size}
+        if _replay_dir:
+            from .fixtures import ReplayAdapter, get_fixtures
+            _adapter = ReplayAdapter(get_fixtures(_replay_dir))
+        elif _record_dir:
+            from .fixtures import RecordingAdapter, get_fixtures
+            _adapter = RecordingAdapter(get_fixtures(_record_dir), **pool)
+        else:
+            from requests.adapters import HTTPAdapter
+            _adapter = HTTPAdapter(**pool)
+    return _adapter
+
+
+def _new_session():
+    """A session mounting the shared adapter. Call with _lock held."""
+    import requests
+
+    session = requests.Session()
+    adapter = _get_adapter()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def make_session():
+    """A requests.Session to talk to BGA, as configured by configure()."""
+    with _lock:
+        return _new_session()
+
+
+def close_session(session):
+    """Close a session from make_session() but not the connections it shares with the others."""
+    session.adapters.clear()
+    session.close()
+
+
+def shared_session():
+    """One session for the requests where cookies do not matter, like the game list.
+    It never keeps a cookie, so it can be used by any thread."""
+    global _shared_session
+    with _lock:
+        if _shared_session is None:
+            from http.cookiejar import DefaultCookiePolicy
+
+            _shared_session = _new_session()
+            _shared_session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        return _shared_session
+
+
+def send(session, method, url, limiter=shared_limiter, **kwargs):
+    """Send a request on session once the rate limiter allows it and report back how it went."""
+    import requests
+
+    slept = limiter.acquire(url)
+    endpoint = metrics.endpoint_path(url)
+    if slept:
+        metrics.registry.inc("bga_rate_limit_sleep_seconds_total", slept, endpoint_class=endpoint_class(url))
+    start = time.monotonic()
+    try:
+        with tracing.span(endpoint, category="http", method=method):
+            response = session.request(method, url, **kwargs)
+    except requests.RequestException:
+        elapsed = time.monotonic() - start
+        limiter.record(url, False, elapsed)
+        metrics.registry.inc("bga_requests_total", method=method, endpoint=endpoint, status="error")
+        metrics.registry.observe("bga_request_seconds", elapsed, method=method, endpoint=endpoint)
+        raise
+    elapsed = time.monotonic() - start
+    overloaded = response.status_code == 429 or response.status_code >= 500
+    limiter.record(url, not overloaded, elapsed)
+    metrics.registry.inc("bga_requests_total", method=method, endpoint=endpoint, status=str(response.status_code))
+    metrics.registry.observe("bga_request_seconds", elapsed, method=method, endpoint=endpoint)
+    if kwargs.get("stream"):
+        # The body is not read yet, and reading it here would defeat streaming
+        size = int(response.headers.get("Content-Length") or 0)
+    else:
+        size = len(response.content)
+    metrics.registry.inc("bga_response_bytes_total", size, endpoint=endpoint)
+    return response
@@ -49,7 +49,7 @@ async def send_message_partials(destination, remainder):
 
 
 def normalize_name(game_name):
-    return re.sub("[^a-z0-7]+", "", game_name.lower())
+    return re.sub("[^a-z0-9]+", "", game_name.lower())
 
 
 def force_double_quotes(string):
@@ -0,0 +1,143 @@
+"""--validate: check users and operations without sending a single request.
+
+Games are looked up in the cached game list and options are compiled with the
+cached game details, the same way they are when a table is created. Group names
+are checked against the cached groups of the creator. What is not in the cache
+cannot be checked and is reported as a warning.
+
+The report can be written as json (--report) for scripts and pre-commit hooks:
+
+    {"valid": false, "errors": 1, "warnings": 0, "problems": [
+        {"level": "error", "check": "options", "operation": 3, "creator": "account 1",
+         "game": "Yahtzee", "message": "..."}]}
+"""
+import json
+import sys
+import typing
+from dataclasses import asdict, dataclass
+
+from .bga_game_list import get_cached_game_catalog
+from .bga_options import DEFAULT_OPTIONS, GAME_INFO_NAMESPACE, OptionError, compile_option
+from .cache_to_file import peek
+from .groups import GROUPS_NAMESPACE, GroupIndex
+
+ERROR = "error"
+WARNING = "warning"
+
+
+@dataclass
+class Problem:
+    level: str
+    check: str
+    message: str
+    # Position of the operation in the operations file, None for the file itself
+    operation: typing.Optional[int] = None
+    creator: typing.Optional[str] = None
+    game: typing.Optional[str] = None
+
+
+class NotCached(Exception):
+    pass
+
+
+def cached_game_info(game_name):
+    entry = peek(game_name, GAME_INFO_NAMESPACE)
+    if entry is None:
+        raise NotCached(game_name)
+    return entry.value
+
+
+def check_options(op, game, creator_groups):
+    """Problems with the options of op, a game of the catalog. creator_groups is a GroupIndex or None if not cached."""
+    problems = []
+    # One by one, to report every invalid option and not only the first one
+    for option, value in (DEFAULT_OPTIONS | op.options).items():
+        try:
+            compile_option(option, value, game["codename"], cached_game_info)
+        except OptionError as e:
+            problems.append((ERROR, str(e)))
+        except NotCached:
+            problems.append((WARNING, f"Details of {game['codename']} are not cached, option {option} was not checked"))
+        except Exception as e:
+            # A bug of compile_option must not stop the checks of the other options
+            problems.append((ERROR, f"Could not check option {option}={value!r}: {e!r}"))
+
+    players = op.options.get("players")
+    if players is not None and "player_numbers" in game:
+        if not str(players).isdigit() or int(players) not in game["player_numbers"]:
+            numbers = ",".join(str(number) for number in game["player_numbers"])
+            problems.append((ERROR, f"{game['display_name_en']} can be played by {numbers} players, not {players}"))
+
+    group = op.options.get("restrictgroup")
+    if group is not None:
+        if creator_groups is None:
+            problems.append((WARNING, f"Groups of {op.toCreate} are not cached, group {group} was not checked"))
+        elif creator_groups.find(group) == -1:
+            groups_str = "[`" + "`,`".join(creator_groups.names()) + "`]"
+            problems.append((ERROR, f"Unable to find group {group}. {op.toCreate} is a member of groups {groups_str}."))
+    return problems
+
+
+def validate(config):
+    """Check config with the cache only. Returns the list of Problem."""
+    from .main import check_operation
+
+    problems = []
+    catalog = get_cached_game_catalog()
+    if catalog is None:
+        problems.append(Problem(WARNING, "games", "The game list is not cached, games and options were not checked"))
+
+    try:
+        users = config.users()
+    except Exception as e:
+        return problems + [Problem(ERROR, "users", str(e))]
+
+    try:
+        root = config.read_operations()
+    except (OSError, ValueError) as e:
+        # Missing or malformed operations file: still write the report
+        return problems + [Problem(ERROR, "config", f"Could not read {config.operations_path}: {e}")]
+
+    groups = {}
+    errors = []
+    for index, op in enumerate(config.iter_operations(errors, root)):
+        def add(level, check, message):
+            problems.append(Problem(level, check, message, index, op.toCreate, op.game))
+
+        for error in check_operation(op, users, catalog):
+            add(ERROR, "operation", str(error.args[0]))
+        game = catalog.lookup(op.game) if catalog is not None else None
+        if game is None:
+            continue
+
+        if op.toCreate not in groups:
+            entry = peek(op.toCreate, GROUPS_NAMESPACE)
+            groups[op.toCreate] = GroupIndex(entry.value) if entry is not None else None
+        for level, message in check_options(op, game, groups[op.toCreate]):
+            add(level, "options", message)
+
+    problems.extend(Problem(ERROR, "operations file", repr(error)) for error in errors)
+    return problems
+
+
+def report(problems, path=None):
+    """Print problems and write the json report to path ("-" for stdout). Returns True if there is no error."""
+    errors = sum(problem.level == ERROR for problem in problems)
+    content = {
+        "valid": errors == 0,
+        "errors": errors,
+        "warnings": len(problems) - errors,
+        "problems": [asdict(problem) for problem in problems],
+    }
+    if path == "-":
+        json.dump(content, sys.stdout, indent=2)
+        print()
+    else:
+        for problem in problems:
+            where = f"operation {problem.operation} ({problem.creator}, {problem.game}): " if problem.operation is not None else ""
+            print(f"{problem.level}: {where}{problem.message}")
+        print("config validated" if errors == 0 else f"config has {errors} errors")
+        if path is not None:
+            with open(path, "w") as f:
+                json.dump(content, f, indent=2)
+    return errors == 0
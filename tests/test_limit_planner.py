@@ -0,0 +1,74 @@
+import unittest
+
+from bga_match_maker.limit_planner import plan_limits
+from bga_match_maker.main import Limit, LimitCount, Operation
+
+
+def make_limits(operations, current=None):
+    """{name: LimitCount} of the limits of operations, like reconcile builds it."""
+    current = current or {}
+    limits = {}
+    for op in operations:
+        for limit in op.limits:
+            count = limits.setdefault(limit.name, LimitCount(target=limit.limit, current=current.get(limit.name, 0)))
+            count.ops.add(op)
+    return limits
+
+
+def satisfied(limits, plan):
+    created = {name: 0 for name in limits}
+    for op, _ in plan.choices:
+        for limit in op.limits:
+            created[limit.name] += 1
+    return {name for name, limit in limits.items() if limit.current + created[name] == limit.target}
+
+
+class PlanNestedTest(unittest.TestCase):
+    def test_satisfies_the_most_limits(self):
+        # P(2) > {A(2) > {A1(1), A2(1)}, B(1)}, one operation per innermost limit
+        p, a, a1, a2, b = Limit("P", 2), Limit("A", 2), Limit("A1", 1), Limit("A2", 1), Limit("B", 1)
+        ops = [Operation("g", "c", (p, a, a1)), Operation("g", "c", (p, a, a2)), Operation("g", "c", (p, b))]
+        limits = make_limits(ops)
+        plan = plan_limits(limits, ops)
+        self.assertEqual([name for _, name in plan.choices], ["A1", "A2"])
+        self.assertEqual(satisfied(limits, plan), {"P", "A", "A1", "A2"})
+
+    def test_fills_inner_limit_and_parent(self):
+        # P(3) has 5 operations of its own and A(1) one
+        p, a = Limit("P", 3), Limit("A", 1)
+        ops = [Operation("g", "c", (p,)) for _ in range(5)] + [Operation("g", "c", (p, a))]
+        limits = make_limits(ops)
+        plan = plan_limits(limits, ops)
+        self.assertEqual(len(plan.choices), 3)
+        self.assertEqual(satisfied(limits, plan), {"P", "A"})
+
+    def test_filled_parent_creates_nothing(self):
+        p, a = Limit("P", 1), Limit("A", 1)
+        ops = [Operation("g", "c", (p, a))]
+        limits = make_limits(ops, current={"P": 1})
+        plan = plan_limits(limits, ops)
+        self.assertEqual(plan.choices, [])
+        self.assertIn("P: 1/1 already filled", plan.notes)
+
+    def test_creates_as_many_tables_as_possible(self):
+        # Not enough operations to satisfy P(4): still create all of them
+        p, a, b = Limit("P", 4), Limit("A", 2), Limit("B", 2)
+        ops = [Operation("g", "c", (p, a)), Operation("g", "c", (p, b)), Operation("g", "c", (p, b))]
+        limits = make_limits(ops)
+        plan = plan_limits(limits, ops)
+        self.assertEqual(len(plan.choices), 3)
+        self.assertEqual(satisfied(limits, plan), {"B"})
+
+
+class PlanGreedyTest(unittest.TestCase):
+    def test_limits_that_are_not_nested(self):
+        a, b = Limit("A", 1), Limit("B", 1)
+        ops = [Operation("g", "c", (a, b)), Operation("g", "c", (b, a))]
+        limits = make_limits(ops)
+        plan = plan_limits(limits, ops)
+        self.assertEqual(len(plan.choices), 1)
+        self.assertIn("not nested", plan.notes[0])
+
+
+if __name__ == "__main__":
+    unittest.main()